@@ -0,0 +1,161 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import load_data
+import instrument
+
+# disorder flag -> column name in the aggregate tables, in table order
+DISORDER_FLAGS = {'ANXIETYFLG': 'ANXIETY', 'ADHDFLG': 'ADHD', 'DEPRESSFLG': 'DEPRESS',
+                  'SCHIZOFLG': 'SCHIZO', 'TRAUSTREFLG': 'TRAUMA'}
+# the demographic columns we group by (whichever of them are loaded)
+DIMENSIONS = ['STATEFIP', 'AGE', 'MARSTAT', 'EMPLOY', 'EDUC', 'RACE', 'REGION', 'GENDER', 'YEAR']
+
+# codes run from -9 (missing) up to the int8 max, shift them so they can index an array
+OFFSET = 9
+LEVELS = 128 + OFFSET
+# YEAR is the one dimension outside the int8 range
+YEAR_OFFSET = -2000
+YEAR_LEVELS = 100
+# every combination of the five flags
+PATTERNS = 2 ** len(DISORDER_FLAGS)
+# row p says which disorders flag pattern p contains
+BITS = (np.arange(PATTERNS)[:, None] >> np.arange(len(DISORDER_FLAGS))) & 1
+# the five flag pattern inside each 13 flag DISORDERS bitmask
+_BITMASKS = np.arange(2 ** len(load_data.FLAGS))
+FROM_BITMASK = sum(((_BITMASKS >> load_data.FLAGS.index(flag)) & 1) << bit
+                   for (bit, flag) in enumerate(DISORDER_FLAGS))
+
+
+def flag_patterns(df):
+    '''
+    packs the five disorder flags of each row into one small int
+    read straight out of the DISORDERS bitmask when the frame has one
+    '''
+    if load_data.FLAG_COLUMN in df.columns:
+        return FROM_BITMASK[df[load_data.FLAG_COLUMN].to_numpy()]
+    patterns = np.zeros(len(df), dtype=np.int64)
+    for bit, flag in enumerate(DISORDER_FLAGS):
+        patterns |= (df[flag].to_numpy() == 1).astype(np.int64) << bit
+    return patterns
+
+
+def _shape(dim):
+    '''
+    (offset, number of levels) of the count array for a dimension
+    '''
+    if dim == 'YEAR':
+        return (YEAR_OFFSET, YEAR_LEVELS)
+    return (OFFSET, LEVELS)
+
+
+class DisorderAggregates:
+    '''
+    Disorder counts for every demographic dimension at once.
+    For each dimension we keep a dense (code x flag pattern) count
+    array, so every table is just a small matrix product away.
+    The arrays have a fixed shape, so partial aggregates (from chunks,
+    files or workers) are merged by adding them together.
+    '''
+    def __init__(self, counts):
+        self._counts = counts
+
+
+    @classmethod
+    def from_frame(cls, df, dimensions=None):
+        '''
+        one bincount per dimension over the packed flags,
+        instead of a full groupby for every table
+        '''
+        if dimensions is None:
+            dimensions = [dim for dim in DIMENSIONS if dim in df.columns]
+        patterns = flag_patterns(df)
+        counts = {}
+        for dim in dimensions:
+            offset, levels = _shape(dim)
+            keys = (df[dim].to_numpy().astype(np.int64) + offset) * PATTERNS + patterns
+            counts[dim] = np.bincount(keys, minlength=levels * PATTERNS).reshape(levels, PATTERNS)
+        return cls(counts)
+
+
+    def __add__(self, other):
+        return DisorderAggregates({dim: self._counts[dim] + other._counts[dim]
+                                   for dim in self._counts})
+
+
+    @classmethod
+    def merge(cls, parts):
+        '''
+        adds up partial aggregates, in any order or grouping
+        '''
+        total = None
+        for part in parts:
+            total = part if total is None else total + part
+        return total
+
+
+    def dimensions(self):
+        return list(self._counts)
+
+
+    def table(self, dim):
+        '''
+        same table as
+        df.groupby(dim).aggregate({'ANXIETYFLG':'sum', ..., 'TRAUSTREFLG':['sum','count']})
+        with the columns flattened to ANXIETY, ADHD, DEPRESS, SCHIZO, TRAUMA, TOTAL
+        rates are added by metrics.rates
+        '''
+        counts = self._counts[dim]
+        total = counts.sum(axis=1)
+        present = np.nonzero(total)[0]
+        sums = counts[present] @ BITS
+
+        offset, levels = _shape(dim)
+        table = pd.DataFrame(sums, columns=list(DISORDER_FLAGS.values()),
+                             index=pd.Index(present - offset, name=dim))
+        table['TOTAL'] = total[present]
+        return table
+
+
+@instrument.timed
+def aggregate_files(paths, chunk_size=load_data.CHUNK_SIZE, dimensions=None):
+    '''
+    streams one or more csvs in chunks of chunk_size rows,
+    cleaning and aggregating each chunk before reading the next
+    memory use depends on chunk_size, not on the size of the files
+    '''
+    # imported here, data_prep depends on this module
+    from data_prep import DataPrep
+
+    parts = (DisorderAggregates.from_frame(DataPrep(chunk).clean_df(), dimensions)
+             for path in paths
+             for chunk in load_data.load_chunks(path, chunk_size=chunk_size))
+    return DisorderAggregates.merge(parts)
+
+
+def _aggregate_range(task):
+    '''
+    worker for aggregate_parallel: parse, clean and aggregate one byte range
+    '''
+    from data_prep import DataPrep
+
+    path, start, end, dimensions = task
+    chunk = load_data.load_range(path, start, end)
+    return DisorderAggregates.from_frame(DataPrep(chunk).clean_df(), dimensions)
+
+
+@instrument.timed
+def aggregate_parallel(paths, workers=None, dimensions=None):
+    '''
+    splits each csv into line aligned byte ranges and aggregates them
+    on a process pool, only the small count arrays come back
+    gives exactly the same aggregates as aggregate_files
+    '''
+    if workers is None:
+        workers = os.cpu_count()
+    # a few ranges per worker so a slow range doesn't hold everyone up
+    tasks = [(path, start, end, dimensions)
+             for path in paths
+             for (start, end) in load_data.byte_ranges(path, workers * 4)]
+    with ProcessPoolExecutor(workers) as pool:
+        return DisorderAggregates.merge(pool.map(_aggregate_range, tasks))
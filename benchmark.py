@@ -0,0 +1,218 @@
+import os
+import json
+import time
+import timeit
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+from bs4 import BeautifulSoup
+import load_data
+import instrument
+import codebook
+import machine_learning
+import comorbidity
+import metrics
+import render
+import main as report
+from data_prep import DataPrep
+from features import FeatureEncoder
+import scrape_income
+import scrape_weather
+
+INCOME_FIXTURE = 'fixtures/income.html'
+WEATHER_FIXTURE = 'fixtures/weather.html'
+RESULTS_DIR = os.path.join('.cache', 'benchmarks')
+ROWS = 1000000
+SEED = 163
+
+
+def _soup_income(html):
+    # the scraper before html_table: html.parser and every <td> in the page
+    soup = BeautifulSoup(html, 'html.parser')
+    table = soup.select('#mw-content-text > div.mw-parser-output > table:nth-child(12)')
+    cols = [col.get_text() for col in table[0].select('tbody > tr > td')]
+    state = pd.Series([cols[e+1] for e in range(0, len(cols)) if e % 13 == 0]).apply(lambda s: s[:(len(s)-1)])
+    income_2019 = pd.Series([cols[e+2] for e in range(0, len(cols)) if e % 13 == 0]).apply(
+        lambda s: int((s[1:(len(s)-1)]).replace(',', '')))
+    return pd.DataFrame({'State': list(state), 'Avg Income 2019': income_2019})
+
+
+def _soup_weather(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    table = soup.select('#hcontent > table')
+    cols = [col.get_text() for col in table[0].select('tr > td')]
+    col2 = [cols[(3 * e) + 1] for e in range(1, 52)]
+    state_name = [col.get_text() for col in table[0].select('tr > td > a')]
+    ser = pd.Series(col2).apply(lambda s: float(s[0:5]))
+    return pd.DataFrame({'Avg Temp': list(ser), 'State Name': state_name})
+
+
+def bench_parsers(repeat=50):
+    '''
+    milliseconds per parse of the saved pages, old soup scrapers vs html_table
+    '''
+    results = []
+    for (name, fixture, old, new) in [('income', INCOME_FIXTURE, _soup_income, scrape_income.parse),
+                                      ('weather', WEATHER_FIXTURE, _soup_weather, scrape_weather.parse)]:
+        with open(fixture, 'rb') as f:
+            html = f.read()
+        # keep the best of a few runs, the others are noise
+        old_ms = min(timeit.repeat(lambda: old(html), number=repeat, repeat=3)) / repeat * 1000
+        new_ms = min(timeit.repeat(lambda: new(html), number=repeat, repeat=3)) / repeat * 1000
+        results.append({'source': name, 'soup ms': round(old_ms, 3), 'html_table ms': round(new_ms, 3),
+                        'speedup': round(old_ms / new_ms, 1)})
+    return pd.DataFrame(results)
+
+
+def synthetic(rows=ROWS, seed=SEED):
+    '''
+    a fake MH-CLD dataset with the real file's columns and dtypes
+    every coded column is drawn from its codebook values, in the
+    proportions the codebook's frequency column gives them
+    '''
+    rng = np.random.default_rng(seed)
+    data = {'YEAR': np.full(rows, 2019, dtype=np.int16)}
+    for col in load_data.CODED_COLUMNS:
+        values = codebook.registry()['tables'][col]['values']
+        codes = np.array([value for (value, _, _, _) in values], dtype=np.int8)
+        counts = np.array([int(frequency.replace(',', '')) for (_, _, frequency, _) in values], dtype=float)
+        data[col] = rng.choice(codes, size=rows, p=counts / counts.sum())
+    # every state is in one region and one division, as in the real file
+    _, first, state = np.unique(data['STATEFIP'], return_index=True, return_inverse=True)
+    for col in ['REGION', 'DIVISION']:
+        data[col] = data[col][first][state]
+    data['CASEID'] = 20190000001 + np.arange(rows, dtype=np.int64)
+    return pd.DataFrame(data)
+
+
+def measure(fn, *args):
+    '''
+    runs fn(*args) as an instrumented stage and returns its result and
+    how long it took, with the peak resident memory while it ran
+    '''
+    with instrument.stage(getattr(fn, '__name__', 'stage')) as record:
+        result = fn(*args)
+    peak = None
+    if record['mem_delta_mb'] is not None:
+        peak = round(record['rss_mb'] + record['mem_delta_mb'], 1)
+    return result, {'seconds': record['wall_s'], 'cpu_seconds': record['cpu_s'],
+                    'peak_rss_mb': peak, 'rss_delta_mb': record['mem_delta_mb']}
+
+
+def _render_jobs(jobs, out_dir):
+    for job in jobs:
+        job.filename = os.path.join(out_dir, job.filename)
+    return render.render(jobs, 1, force=True, manifest=os.path.join(out_dir, 'figures.json'))
+
+
+def _train(features, labels):
+    train_rows, _ = machine_learning.split_rows(len(labels))
+    return machine_learning.train_the_model(features[train_rows], labels[train_rows])
+
+
+def run(rows=ROWS, seed=SEED):
+    '''
+    times each stage of the report and the model on synthetic data
+    returns stage -> seconds and memory, in the order they ran
+    '''
+    stages = {}
+
+    def stage(name, fn, *args):
+        result, stages[name] = measure(fn, *args)
+        return result
+
+    features = machine_learning.FEATURE_COLUMNS
+    with tempfile.TemporaryDirectory() as tmp:
+        csv = os.path.join(tmp, 'synthetic.csv')
+        synthetic(rows, seed).to_csv(csv, index=False)
+
+        raw = stage('load', load_data.load, csv)
+        data = DataPrep(raw)
+        df = stage('clean_df', data.clean_df)
+        del raw
+        stage('aggregates', data.aggregates, df)
+        states = stage('groupby_state', data.groupby_state, df)
+        age = stage('age_data', data.age_data, df)
+        stage('employment_data', data.employment_data, df)
+        stage('groupby_education', data.groupby_education, df)
+        stage('education_percentage', data.education_percentage, df)
+        stage('marital_data', data.marital_data, df)
+        stage('comorbidity', comorbidity.cooccurrence, df[load_data.FLAG_COLUMN], df['STATEFIP'])
+        geo = stage('join_data_geo', data.join_data_geo, states)
+        geo = stage('metrics', metrics.rates, geo)
+        age = metrics.rates(age)
+
+        stage('merge_features_get_dummies',
+              lambda: pd.get_dummies(machine_learning.merge_features(machine_learning.scrape_tables(),
+                                                                     df[features])))
+        matrix = stage('feature_encoder', FeatureEncoder(features).transform, df)
+        stage('train', _train, matrix, df['DIAGNOSIS 1'].to_numpy())
+
+        stage('render_age', _render_jobs, report.plot_age(df, age), tmp)
+        stage('render_geospatial', _render_jobs, report.plot_geospatial(geo), tmp)
+    return stages
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def save(stages, rows, seed=SEED, path=None):
+    '''
+    writes the results with what they were measured on, so runs on
+    different commits can be compared
+    '''
+    commit = _commit()
+    if path is None:
+        path = os.path.join(RESULTS_DIR, commit + '-' + str(rows) + '.json')
+    result = {'commit': commit, 'rows': rows, 'seed': seed, 'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python': platform.python_version(), 'pandas': pd.__version__, 'cpus': os.cpu_count(),
+              'stages': stages}
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=1)
+    return path
+
+
+def compare(old_path, new_path):
+    '''
+    table of two saved runs side by side, with new / old for time and memory
+    '''
+    with open(old_path) as f:
+        old = json.load(f)['stages']
+    with open(new_path) as f:
+        new = json.load(f)['stages']
+    old = pd.DataFrame(old).T
+    new = pd.DataFrame(new).T
+    table = pd.DataFrame({'old s': old['seconds'], 'new s': new['seconds'],
+                          'time ratio': new['seconds'] / old['seconds'],
+                          'old MB': old['rss_delta_mb'], 'new MB': new['rss_delta_mb']})
+    return table.round(3)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the stages of the report on synthetic data')
+    parser.add_argument('--rows', type=int, default=ROWS, help='rows of synthetic data, e.g. 10000000')
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--output', default=None,
+                        help='json file for the results (default: ' + RESULTS_DIR + '/<commit>-<rows>.json)')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two saved results instead of running')
+    parser.add_argument('--parsers', action='store_true',
+                        help='only time the weather and income page parsers')
+    args = parser.parse_args()
+    if args.compare:
+        print(compare(*args.compare))
+    elif args.parsers:
+        print(bench_parsers())
+    else:
+        stages = run(args.rows, args.seed)
+        print(pd.DataFrame(stages).T)
+        print('Saved', save(stages, args.rows, args.seed, args.output))
@@ -0,0 +1,160 @@
+'''
+One entry point for the project: python cli.py <command> [options]
+
+  report            read the data and draw the figures (main.py)
+  train             fit and score the diagnosis model (machine_learning.py)
+  score             predict the diagnosis for every row of a csv with a saved model
+  test              run tests.py
+  rebuild-codebook  compile codebook.json from the codebook pdf (needs tabula and Java)
+
+Each command imports what it needs only once it runs, so --help and
+bad arguments never wait for pandas, geopandas, seaborn or sklearn.
+'''
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+# seconds python cli.py --help may take, checked by tests.py
+IMPORT_BUDGET = 1.0
+# modules that must not be imported until a command runs
+HEAVY_MODULES = ['pandas', 'numpy', 'geopandas', 'matplotlib', 'seaborn', 'sklearn',
+                 'scipy', 'pyarrow', 'requests', 'bs4', 'lxml', 'tabula']
+
+
+def report(args):
+    import load_data
+    import instrument
+    import main
+
+    instrument.profile(args.profile, args.profiler)
+    main.main(args.data or [load_data.DATA_FILE], args.chunk_size, args.workers, args.plot_workers,
+              args.force, args.dry_run, args.offline, args.report or instrument.REPORT_FILE)
+
+
+def train(args):
+    import machine_learning
+
+    columns = machine_learning.FEATURE_COLUMNS
+    if args.extra_features:
+        columns = columns + machine_learning.EXTRA_FEATURE_COLUMNS
+    jobs = machine_learning.N_JOBS if args.jobs is None else args.jobs
+    machine_learning.main(columns, args.model, args.folds, jobs,
+                          args.save or machine_learning.MODEL_FILE, args.search)
+
+
+def score(args):
+    import machine_learning
+
+    machine_learning.score(args.data, args.output, args.model or machine_learning.MODEL_FILE,
+                           args.chunk_size or machine_learning.SCORE_CHUNK_SIZE)
+
+
+def test(args):
+    import tests
+
+    # any failing check raises, so python cli.py test exits non-zero
+    tests.main()
+    print('All tests passed')
+
+
+def rebuild_codebook(args):
+    import codebook
+
+    rebuilt = codebook.rebuild(args.pdf or codebook.CODEBOOK_PDF, args.output or codebook.CODEBOOK_FILE)
+    print('Rebuilt', args.output or codebook.CODEBOOK_FILE, 'version', rebuilt['version'],
+          'with', len(rebuilt['tables']), 'tables')
+
+
+def parser():
+    '''
+    the options of every command
+    defaults that live in other modules are left as None, so the
+    parser can be built without importing them
+    '''
+    parser = argparse.ArgumentParser(description='Mental health disorders in the United States')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    report_parser = commands.add_parser('report', help='plot mental health disorders in the US')
+    report_parser.add_argument('--data', nargs='+', default=None,
+                               help='one or more MH-CLD csv files, e.g. several years '
+                                    '(default: mhcld-puf-2019-csv.csv)')
+    report_parser.add_argument('--chunk-size', type=int, default=None,
+                               help='stream the csvs in chunks of this many rows instead of loading them')
+    report_parser.add_argument('--workers', type=int, default=None,
+                               help='aggregate the csvs on this many processes')
+    report_parser.add_argument('--plot-workers', type=int, default=None,
+                               help='render the figures on this many processes (default: one per core)')
+    report_parser.add_argument('--force', action='store_true',
+                               help='render every figure, even the ones whose inputs have not changed')
+    report_parser.add_argument('--dry-run', action='store_true',
+                               help='only list the figures that are out of date')
+    report_parser.add_argument('--offline', action='store_true',
+                               help='never go online, use the saved snapshots of the weather and income pages')
+    report_parser.add_argument('--report', default=None,
+                               help='json file for the time and memory of each stage '
+                                    '(default: .cache/run_report.json)')
+    report_parser.add_argument('--profile', nargs='+', default=[], metavar='STAGE',
+                               help='profile the stages whose name contains one of these, e.g. '
+                                    'plot_income DataPrep.clean_df (saved in .cache/profiles)')
+    report_parser.add_argument('--profiler', choices=['cprofile', 'pyinstrument'], default='cprofile')
+    report_parser.set_defaults(run=report)
+
+    train_parser = commands.add_parser('train', help='predict the first mental health diagnosis')
+    train_parser.add_argument('--extra-features', action='store_true',
+                              help='also use GENDER, ETHNIC, STATEFIP and SMISED')
+    train_parser.add_argument('--model', choices=['tree', 'boosting'], default='tree',
+                              help='a decision tree on one-hot columns, or histogram gradient '
+                                   'boosting on the codes as categories')
+    train_parser.add_argument('--folds', type=int, default=None,
+                              help='cross validate on this many folds instead of one 70/30 split')
+    train_parser.add_argument('--jobs', type=int, default=None,
+                              help='fit the folds or search candidates on this many processes '
+                                   '(default: every core, 1 to fit them one at a time)')
+    train_parser.add_argument('--search', action='store_true',
+                              help='pick the model family and hyperparameters by successive halving '
+                                   'on growing subsamples, then train the best')
+    train_parser.add_argument('--save', default=None,
+                              help='where to save the trained model (default: models/mh1.joblib)')
+    train_parser.set_defaults(run=train)
+
+    score_parser = commands.add_parser('score', help='predict the first diagnosis with a saved model')
+    score_parser.add_argument('data', help='csv with the feature columns the model was trained on')
+    score_parser.add_argument('--output', default='predictions.csv',
+                              help='csv for the predictions and class probabilities')
+    score_parser.add_argument('--model', default=None,
+                              help='saved model (default: models/mh1.joblib)')
+    score_parser.add_argument('--chunk-size', type=int, default=None,
+                              help='rows scored at a time (default: 100000)')
+    score_parser.set_defaults(run=score)
+
+    test_parser = commands.add_parser('test', help='run the tests')
+    test_parser.set_defaults(run=test)
+
+    codebook_parser = commands.add_parser('rebuild-codebook',
+                                          help='compile codebook.json from the codebook pdf')
+    codebook_parser.add_argument('--pdf', default=None,
+                                 help='codebook pdf (default: MH-CLD-2019-DS0001-info-codebook.pdf)')
+    codebook_parser.add_argument('--output', default=None, help='registry file (default: codebook.json)')
+    codebook_parser.set_defaults(run=rebuild_codebook)
+    return parser
+
+
+def startup_time(args):
+    '''
+    seconds a fresh python takes to run cli.py with these arguments
+    '''
+    start = time.perf_counter()
+    subprocess.run([sys.executable, os.path.abspath(__file__)] + list(args),
+                   stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
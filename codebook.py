@@ -0,0 +1,151 @@
+import json
+import re
+import numpy as np
+import pandas as pd
+import load_data
+import scrape_cache
+import instrument
+
+CODEBOOK_PDF = 'MH-CLD-2019-DS0001-info-codebook.pdf'
+CODEBOOK_FILE = 'codebook.json'
+
+# the single page pdfs the analysis used to scrape, and the codebook table on each
+PDF_TABLES = {'age.pdf': 'AGE', 'education.pdf': 'EDUC', 'employment.pdf': 'EMPLOY',
+              'marstat.pdf': 'MARSTAT', 'race.pdf': 'RACE', 'region.pdf': 'REGION',
+              'mh1.pdf': 'MH1'}
+
+# lines of the codebook text
+_VARIABLE = re.compile(r'^([A-Z0-9]+): (.+)$')
+_HEADER = 'Value Label Frequency %'
+_ROW = re.compile(r'^(-?\d+) (.+) ([\d,]+) ([\d.]+%)$')
+_TOTAL = re.compile(r'^Total ([\d,]+) ([\d.]+%)$')
+
+_registry = None
+
+
+def _tabula_table(pdf, pages):
+    from tabula import read_pdf
+
+    return read_pdf(pdf, pages=pages)[0]
+
+
+@instrument.timed
+def read_pdf_table(pdf, pages='1'):
+    '''
+    uses tabula library (starts a JVM)
+    scrapes the first table on a pdf page
+    tables are cached, so the same pdf is only ever scraped once
+    '''
+    return scrape_cache.SCRAPE_CACHE.get(pdf, pages, _tabula_table)
+
+
+def _lines(pdf):
+    '''
+    text lines of every page of the pdf, with whitespace normalized
+    '''
+    from tabula import read_pdf
+
+    pages = read_pdf(pdf, pages='all', stream=True, guess=False,
+                     pandas_options={'header': None})
+    for page in pages:
+        for row in page.itertuples(index=False):
+            cells = [str(cell) for cell in row if not pd.isna(cell)]
+            if cells:
+                yield ' '.join(' '.join(cells).split())
+
+
+def rebuild(pdf=CODEBOOK_PDF, path=CODEBOOK_FILE):
+    '''
+    extracts every Value -> Label table from the codebook pdf
+    and writes them to the registry file
+    only needed when the codebook changes, this is the one place tabula runs
+    '''
+    tables = {}
+    variable = None
+    in_table = False
+    for line in _lines(pdf):
+        if in_table:
+            row = _ROW.match(line)
+            total = _TOTAL.match(line)
+            if row:
+                value, label, frequency, percent = row.groups()
+                tables[variable]['values'].append([int(value), label, frequency, percent])
+            elif total:
+                tables[variable]['total'] = list(total.groups())
+                in_table = False
+        elif line == _HEADER and variable is not None:
+            in_table = True
+        else:
+            match = _VARIABLE.match(line)
+            if match:
+                variable = match.group(1)
+                # tables that run over a page repeat the variable name
+                tables.setdefault(variable, {'label': match.group(2), 'values': [], 'total': None})
+
+    registry = {'version': load_data.file_hash(pdf)[:12], 'source': pdf,
+                'tables': {name: table for (name, table) in tables.items() if table['values']}}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(registry, f, indent=1, ensure_ascii=False)
+    return registry
+
+
+def registry(path=CODEBOOK_FILE):
+    '''
+    the compiled codebook, loaded once per process
+    '''
+    global _registry
+    if _registry is None:
+        with open(path, encoding='utf-8') as f:
+            _registry = json.load(f)
+    return _registry
+
+
+def version():
+    return registry()['version']
+
+
+def table(variable, total=True):
+    '''
+    the codebook table for a variable, in the same shape tabula scraped it:
+    Value, Label, Frequency and % columns, ending with the Total row
+    '''
+    entry = registry()['tables'][variable]
+    rows = [[float(value), label, frequency, percent]
+            for (value, label, frequency, percent) in entry['values']]
+    if total and entry['total'] is not None:
+        rows.append([float('nan'), 'Total'] + entry['total'])
+    return pd.DataFrame(rows, columns=['Value', 'Label', 'Frequency', '%'])
+
+
+def labels(variable):
+    '''
+    code -> label dict for a variable
+    '''
+    return {value: label for (value, label, _, _) in registry()['tables'][variable]['values']}
+
+
+def decode(codes, lookup):
+    '''
+    code -> label for a whole column in one pass, as a categorical
+    lookup is a code -> label dict, e.g. labels('AGE')
+    codes with no label become NaN, like a left merge would leave them
+    categories are sorted and only the ones that occur are kept
+    '''
+    codes = np.asarray(codes).astype(np.int64)
+    keys = np.fromiter(lookup.keys(), dtype=np.int64, count=len(lookup))
+    categories = sorted(set(lookup.values()))
+    positions = np.array([categories.index(label) for label in lookup.values()], dtype=np.int64)
+
+    # dense array from every possible code to the position of its label
+    low = min(keys.min(), codes.min(initial=0))
+    high = max(keys.max(), codes.max(initial=0))
+    table = np.full(high - low + 1, -1, dtype=np.int64)
+    table[keys - low] = positions
+    return pd.Categorical.from_codes(table[codes - low], categories).remove_unused_categories()
+
+
+if __name__ == '__main__':
+    # the same as python cli.py rebuild-codebook
+    import cli
+
+    cli.main(['rebuild-codebook'])
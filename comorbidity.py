@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import load_data
+import data_cache
+
+# every possible DISORDERS bitmask
+PATTERNS = 2 ** len(load_data.FLAGS)
+
+
+def load_flags(path=load_data.DATA_FILE, by=None, cache_dir=data_cache.CACHE_DIR):
+    '''
+    the DISORDERS bitmask of every row (and the by column, e.g. STATEFIP or AGE)
+    from the cleaned data cache, 2 bytes of flags a row instead of 13
+    '''
+    columns = [load_data.FLAG_COLUMN] + ([by] if by else [])
+    df = data_cache.load_clean(path, columns, cache_dir)
+    return (df[load_data.FLAG_COLUMN].to_numpy(), df[by] if by else None)
+
+
+def pattern_counts(bits, groups=None):
+    '''
+    rows with each exact bitmask, from a single bincount over the bitmask
+    returns (the bitmasks that occur, group keys, groups x bitmasks counts)
+    without groups there is one row of counts and its key is None
+    '''
+    bits = np.asarray(bits).astype(np.int64)
+    if groups is None:
+        group = np.zeros(len(bits), dtype=np.int64)
+        keys = [None]
+    else:
+        group, keys = pd.factorize(np.asarray(groups), sort=True)
+    counts = np.bincount(group * PATTERNS + bits, minlength=len(keys) * PATTERNS)
+    counts = counts.reshape(len(keys), PATTERNS)
+    patterns = np.nonzero(counts.any(axis=0))[0]
+    return (patterns, keys, counts[:, patterns])
+
+
+def _has(patterns, flags):
+    '''
+    patterns x flags 0/1 matrix of the flags in each bitmask
+    '''
+    return (patterns[:, None] >> np.arange(len(flags))) & 1
+
+
+def _group_index(keys, groups, inner):
+    return pd.MultiIndex.from_product([keys, inner], names=[getattr(groups, 'name', None), inner.name])
+
+
+def cooccurrence(bits, groups=None, flags=load_data.FLAGS):
+    '''
+    flags x flags table of the rows that have both flags, with the rows
+    that have each flag on the diagonal
+    only the few distinct bitmasks are multiplied out, so every pair
+    comes from the same single pass over the rows
+    with groups (e.g. the STATEFIP column) there is one table per group,
+    stacked with the group as the outer index level
+    '''
+    patterns, keys, counts = pattern_counts(bits, groups)
+    has = _has(patterns, flags)
+    tables = np.einsum('gp,pi,pj->gij', counts, has, has, optimize=True)
+    if groups is None:
+        return pd.DataFrame(tables[0], index=pd.Index(flags, name='FLAG'), columns=flags)
+    index = _group_index(keys, groups, pd.Index(flags, name='FLAG'))
+    return pd.DataFrame(tables.reshape(-1, len(flags)), index=index, columns=flags)
+
+
+def combinations(bits, groups=None, flags=load_data.FLAGS):
+    '''
+    rows with each exact combination of flags that occurs, most common first
+    combinations are named by their flags joined with +, NONE for no flags
+    with groups the counts are for every combination that occurs in each group
+    '''
+    patterns, keys, counts = pattern_counts(bits, groups)
+    has = _has(patterns, flags)
+    names = ['+'.join(flag for (flag, bit) in zip(flags, row) if bit) or 'NONE' for row in has]
+    order = np.argsort(-counts.sum(axis=0), kind='stable')
+    combination = pd.Index(np.array(names)[order], name='COMBINATION')
+    if groups is None:
+        return pd.Series(counts[0, order], index=combination, name='COUNT')
+    index = _group_index(keys, groups, combination)
+    counts = pd.Series(counts[:, order].ravel(), index=index, name='COUNT')
+    return counts[counts > 0]
@@ -0,0 +1,270 @@
+import os
+import numpy as np
+import pandas as pd
+import load_data
+import data_cache
+
+# categorical codebook fields the cube is broken down by
+CUBE_DIMENSIONS = ['AGE', 'EDUC', 'RACE', 'ETHNIC', 'GENDER', 'MARSTAT', 'EMPLOY',
+                   'STATEFIP', 'REGION', 'DIVISION']
+# dimensions another one fixes: every state is in one region and one division
+DERIVED = {'REGION': 'STATEFIP', 'DIVISION': 'STATEFIP'}
+# all 13 disorder flags
+FLAGS = load_data.FLAGS
+# codes start at -9, so code + OFFSET indexes the marginal arrays
+OFFSET = 9
+
+
+class CountCube:
+    '''
+    Case counts and disorder flag sums for every combination of the
+    codebook dimensions.
+
+    A fully dense array over all ten dimensions would have about a
+    billion cells, almost all of them empty, so only the observed
+    cells are stored: one row per combination, with TOTAL and one
+    column per flag. REGION and DIVISION are left out of the cells
+    whenever STATEFIP fixes them, and mapped back from it when a query
+    needs them.
+
+    Every one and two dimension marginal is small enough to keep dense,
+    one array indexed by code + OFFSET with TOTAL and the flag sums on
+    the last axis, so marginals and cross-tabs are served by indexing
+    those. Only queries by three or more dimensions, or with a where
+    filter, are a groupby over the cells.
+    '''
+    def __init__(self, cells, dimensions=CUBE_DIMENSIONS, derived=None, marginals=None):
+        self._cells = cells
+        self._dimensions = list(dimensions)
+        self._derived = derived or {}
+        self._marginals = self._count_marginals() if marginals is None else marginals
+
+
+    @classmethod
+    def from_frame(cls, df, dimensions=CUBE_DIMENSIONS):
+        '''
+        builds the cube from row level data
+        '''
+        derived = _derive(df, dimensions)
+        stored = [dim for dim in dimensions if dim not in derived]
+        # mixed radix key over the small integer codes, one int64 per row
+        key = np.zeros(len(df), dtype=np.int64)
+        for dim in stored:
+            codes = df[dim].to_numpy().astype(np.int64) + OFFSET
+            key = key * (int(codes.max(initial=0)) + 1) + codes
+        _, first, cell = np.unique(key, return_index=True, return_inverse=True)
+
+        cells = df[stored].iloc[first].reset_index(drop=True)
+        cells['TOTAL'] = np.bincount(cell)
+        for flag in FLAGS:
+            flags = (df[flag].to_numpy() == 1).astype(np.int64)
+            cells[flag] = np.bincount(cell, weights=flags).astype(np.int64)
+        return cls(cells, dimensions, derived)
+
+
+    @classmethod
+    def from_chunks(cls, chunks, dimensions=CUBE_DIMENSIONS):
+        '''
+        builds the cube one chunk at a time and merges the partial cubes
+        '''
+        return cls.merge([cls.from_frame(chunk, dimensions) for chunk in chunks])
+
+
+    @classmethod
+    def merge(cls, cubes):
+        '''
+        adds partial cubes together, cell by cell
+        '''
+        dimensions = cubes[0]._dimensions
+        cells = pd.concat([cube._frame(dimensions) for cube in cubes], ignore_index=True)
+        cells = cells.groupby(dimensions, as_index=False, sort=True).sum()
+        derived = _derive(cells, dimensions)
+        return cls(cells.drop(columns=list(derived)), dimensions, derived)
+
+
+    def save(self, path):
+        '''
+        writes the cells to the parquet file at path, and the marginals
+        and the REGION and DIVISION of every state next to it as .npz
+        '''
+        self._cells.to_parquet(path, index=False)
+        arrays = {'dimensions': np.array(self._dimensions)}
+        for dim, mapping in self._derived.items():
+            arrays['derived:' + dim] = np.stack([mapping.index.to_numpy(), mapping.to_numpy()])
+        arrays.update(self._marginals)
+        np.savez(_marginal_file(path), **arrays)
+
+
+    @classmethod
+    def load(cls, path):
+        with np.load(_marginal_file(path)) as arrays:
+            arrays = dict(arrays)
+        dimensions = [str(dim) for dim in arrays.pop('dimensions')]
+        derived = {}
+        for name in [name for name in arrays if name.startswith('derived:')]:
+            dim = name.split(':')[1]
+            parents, codes = arrays.pop(name)
+            derived[dim] = pd.Series(codes, index=pd.Index(parents, name=DERIVED[dim]), name=dim)
+        return cls(pd.read_parquet(path), dimensions, derived, arrays)
+
+
+    def cells(self):
+        return self._cells.copy()
+
+
+    def query(self, by, flags=None, where=None):
+        '''
+        TOTAL and disorder flag sums grouped by the dimensions in by
+        where filters the cells first, e.g. {'REGION': 3, 'AGE': [5, 6]}
+        '''
+        if flags is None:
+            flags = FLAGS
+        by = list(np.atleast_1d(by)) if by else []
+        columns = ['TOTAL'] + list(flags)
+        dense = None if where else self._dense(by)
+        if dense is not None:
+            values = dense[..., self._positions(flags)]
+            if not by:
+                return pd.DataFrame([values], columns=columns)
+            # only the combinations with cases, in code order like a groupby
+            present = np.nonzero(values[..., 0] > 0)
+            index = pd.MultiIndex.from_arrays([codes - OFFSET for codes in present], names=by)
+            if len(by) == 1:
+                index = index.get_level_values(0)
+            return pd.DataFrame(values[present], index=index, columns=columns)
+
+        cells = self._frame(by + list(where or {}))
+        if where:
+            mask = np.ones(len(cells), dtype=bool)
+            for dim, values in where.items():
+                mask &= cells[dim].isin(np.atleast_1d(values)).to_numpy()
+            cells = cells[mask]
+        if not by:
+            return cells[columns].sum().to_frame().T
+        return cells.groupby(by)[columns].sum()
+
+
+    def marginal(self, dim, flags=None):
+        return self.query([dim], flags)
+
+
+    def crosstab(self, index, columns, flag=None, rate=False, where=None):
+        '''
+        index x columns table of cases, or of one flag
+        rate divides the flag counts by the cases in each cell
+        combinations with no cases count 0, but their rate is NaN
+        '''
+        index = list(np.atleast_1d(index))
+        columns = list(np.atleast_1d(columns))
+        flags = [] if flag is None else [flag]
+        dense = None if where or len(index) != 1 or len(columns) != 1 else self._dense(index + columns)
+        if dense is not None:
+            totals = dense[..., 0]
+            rows = np.nonzero(totals.any(axis=1))[0]
+            cols = np.nonzero(totals.any(axis=0))[0]
+            totals = totals[np.ix_(rows, cols)]
+            values = dense[..., self._positions(flags)[-1]][np.ix_(rows, cols)]
+            if rate:
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    values = values / totals
+            return pd.DataFrame(values, index=pd.Index(rows - OFFSET, name=index[0]),
+                                columns=pd.Index(cols - OFFSET, name=columns[0]))
+
+        grouped = self.query(index + columns, flags, where)
+        values = grouped['TOTAL'] if flag is None else grouped[flag]
+        if rate:
+            return (values / grouped['TOTAL']).unstack(columns)
+        return values.unstack(columns, fill_value=0)
+
+
+    def _frame(self, dims):
+        '''
+        the cells, with the derived dimensions in dims mapped back in
+        '''
+        derived = {dim: self._derived[dim].reindex(self._cells[DERIVED[dim]]).to_numpy()
+                   for dim in dims if dim in self._derived}
+        return self._cells.assign(**derived) if derived else self._cells
+
+
+    def _count_marginals(self):
+        '''
+        dense TOTAL and flag sums by every dimension and every pair of them
+        '''
+        cells = self._frame(self._dimensions)
+        weights = cells[['TOTAL'] + FLAGS].to_numpy(dtype=np.int64)
+        codes = {dim: cells[dim].to_numpy().astype(np.int64) + OFFSET for dim in self._dimensions}
+        sizes = {dim: int(codes[dim].max(initial=0)) + 1 for dim in self._dimensions}
+        marginals = {}
+        for (i, a) in enumerate(self._dimensions):
+            marginals[a] = _sums(codes[a], weights, sizes[a])
+            for b in self._dimensions[i + 1:]:
+                pair = _sums(codes[a] * sizes[b] + codes[b], weights, sizes[a] * sizes[b])
+                marginals[a + ',' + b] = pair.reshape(sizes[a], sizes[b], -1)
+        return marginals
+
+
+    def _dense(self, by):
+        '''
+        the dense marginal over the dimensions in by, or None when there isn't one
+        '''
+        if not by:
+            return self._marginals[self._dimensions[0]].sum(axis=0)
+        if len(by) == 1:
+            return self._marginals.get(by[0])
+        if len(by) == 2 and by[0] != by[1]:
+            if by[0] + ',' + by[1] in self._marginals:
+                return self._marginals[by[0] + ',' + by[1]]
+            if by[1] + ',' + by[0] in self._marginals:
+                return self._marginals[by[1] + ',' + by[0]].transpose(1, 0, 2)
+        return None
+
+
+    def _positions(self, flags):
+        '''
+        where TOTAL and each flag are on the last axis of the marginals
+        '''
+        return [0] + [1 + FLAGS.index(flag) for flag in flags]
+
+
+def _derive(df, dimensions):
+    '''
+    the code of every DERIVED dimension for each code of the one that
+    fixes it, for those that are fixed in df
+    '''
+    derived = {}
+    for dim, parent in DERIVED.items():
+        if dim not in dimensions or parent not in dimensions:
+            continue
+        parents = df[parent].to_numpy()
+        codes = df[dim].to_numpy()
+        keys, first, inverse = np.unique(parents, return_index=True, return_inverse=True)
+        if np.array_equal(codes[first][inverse], codes):
+            derived[dim] = pd.Series(codes[first], index=pd.Index(keys, name=parent), name=dim)
+    return derived
+
+
+def _sums(key, weights, size):
+    '''
+    sum of every weights column for each key, as a size x columns array
+    '''
+    return np.stack([np.bincount(key, weights=weights[:, i], minlength=size)
+                     for i in range(weights.shape[1])], axis=-1).astype(np.int64)
+
+
+def _marginal_file(path):
+    return os.path.splitext(path)[0] + '.npz'
+
+
+def load_cube(path=load_data.DATA_FILE, cache_dir=data_cache.CACHE_DIR):
+    '''
+    returns the cube for the csv, building it from the cleaned data
+    cache the first time, and again whenever that cache is rebuilt
+    '''
+    source = data_cache.cached(path, cache_dir)
+    cube_file = os.path.splitext(source)[0] + '.cube.parquet'
+    files = [cube_file, _marginal_file(cube_file)]
+    if all(os.path.exists(file) and os.path.getmtime(file) >= os.path.getmtime(source) for file in files):
+        return CountCube.load(cube_file)
+    cube = CountCube.from_frame(data_cache.load_clean(path, CUBE_DIMENSIONS + FLAGS, cache_dir))
+    cube.save(cube_file)
+    return cube
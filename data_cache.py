@@ -0,0 +1,102 @@
+import json
+import os
+import hashlib
+import pyarrow as pa
+import pyarrow.feather as feather
+import load_data
+import instrument
+from data_prep import DataPrep
+
+CACHE_DIR = '.cache'
+# bumped whenever clean_df changes the cached columns, so old caches are rebuilt
+FORMAT = 2
+
+
+def _cache_paths(path, cache_dir):
+    '''
+    cache and metadata files for a csv, keyed by its full path
+    so same-named csvs in different folders don't share a cache
+    '''
+    name = os.path.splitext(os.path.basename(path))[0]
+    name += '-' + hashlib.sha256(os.path.realpath(path).encode()).hexdigest()[:12]
+    return (os.path.join(cache_dir, name + '.feather'),
+            os.path.join(cache_dir, name + '.json'))
+
+
+def _is_fresh(path, cache_file, meta_file):
+    '''
+    checks the cache against the source csv
+    size and mtime are enough when they match, the hash is only
+    computed when the file was touched but may not have changed
+    '''
+    if not os.path.exists(cache_file) or not os.path.exists(meta_file):
+        return False
+    with open(meta_file) as f:
+        meta = json.load(f)
+    if meta.get('format') != FORMAT:
+        return False
+    stat = os.stat(path)
+    if meta['size'] != stat.st_size:
+        return False
+    if meta['mtime'] == stat.st_mtime_ns:
+        return True
+    if meta['sha256'] != load_data.file_hash(path):
+        return False
+    # same content, just remember the new mtime so we don't hash again
+    meta['mtime'] = stat.st_mtime_ns
+    with open(meta_file, 'w') as f:
+        json.dump(meta, f)
+    return True
+
+
+@instrument.timed
+def build(path=load_data.DATA_FILE, cache_dir=CACHE_DIR, chunk_size=load_data.CHUNK_SIZE):
+    '''
+    cleans the csv chunk by chunk and writes it out as an uncompressed
+    feather file, so later runs can memory map it
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_file, meta_file = _cache_paths(path, cache_dir)
+    # a half written cache must never look fresh
+    if os.path.exists(meta_file):
+        os.remove(meta_file)
+    writer = None
+    with pa.OSFile(cache_file, 'wb') as sink:
+        for chunk in load_data.load_chunks(path, chunk_size=chunk_size):
+            clean = DataPrep(chunk).clean_df()
+            batch = pa.RecordBatch.from_pandas(clean, preserve_index=False)
+            if writer is None:
+                writer = pa.ipc.new_file(sink, batch.schema)
+            writer.write_batch(batch)
+        if writer is None:
+            # a csv with no rows still gets a cache, with the columns and no batches
+            empty = DataPrep(load_data.load(path)).clean_df()
+            writer = pa.ipc.new_file(sink, pa.Schema.from_pandas(empty, preserve_index=False))
+        writer.close()
+
+    stat = os.stat(path)
+    with open(meta_file, 'w') as f:
+        json.dump({'format': FORMAT, 'source': os.path.abspath(path), 'size': stat.st_size,
+                   'mtime': stat.st_mtime_ns, 'sha256': load_data.file_hash(path)}, f)
+    return cache_file
+
+
+def cached(path=load_data.DATA_FILE, cache_dir=CACHE_DIR):
+    '''
+    path of an up to date feather cache for the csv, rebuilding it if needed
+    '''
+    cache_file, meta_file = _cache_paths(path, cache_dir)
+    if not _is_fresh(path, cache_file, meta_file):
+        build(path, cache_dir)
+    return cache_file
+
+
+@instrument.timed
+def load_clean(path=load_data.DATA_FILE, columns=None, cache_dir=CACHE_DIR):
+    '''
+    returns the cleaned mental health data (see DataPrep.clean_df)
+    the cache is rebuilt whenever the source csv changes
+    columns use the cleaned names, e.g. 'DIAGNOSIS 1' instead of 'MH1'
+    '''
+    table = feather.read_table(cached(path, cache_dir), columns=columns, memory_map=True)
+    return table.to_pandas()
@@ -1,63 +1,93 @@
 import pandas as pd
 import os
 import pickle
-from tabula import read_pdf
 import geopandas as gpd
+import load_data
+import geometry
+import states as state_table
+import codebook
+import instrument
+import metrics
+from aggregate import DisorderAggregates
+
+RENAMED_COLUMNS = {'SPHSERVICE': 'PSYCH HOSP', 'CMPSERVICE': 'COMM MENTAL HEALTH CENTER',
+                   'OPISERVICE': 'PSYCH INPATIENT', 'RTCSERVICE': 'RES TREATMENT', 'IJSSERVICE': 'JUSTICE SYSTEM',
+                   'MH1': 'DIAGNOSIS 1', 'MH2': 'DIAGNOSIS 2', 'MH3': 'DIAGNOSIS 3', 'SAP': 'SUBSTANCE PROBLEM',
+                   'DETNLF': 'NOT LABOR FORCE', 'LIVARAG': 'RESIDENTIAL STATUS', 'NUMMHS': 'DIAGNOSES NUM'}
+
+def _percents(table):
+    '''
+    the table with each disorder count and TOTAL replaced by the
+    disorder's _PERCENT column from the metrics layer
+    '''
+    counts = list(metrics.DISORDERS) + ['TOTAL']
+    others = [col for col in table.columns if col not in counts]
+    return metrics.rates(table)[others + [disorder + '_PERCENT' for disorder in metrics.DISORDERS]]
 
 
 class DataPrep:
-    def __init__(self, df):
+    def __init__(self, df, aggregates=None):
         self._df = df
+        self._aggregates = aggregates
+        self._aggregated = None
 
 
+    @instrument.timed
     def clean_df(self):
         '''
         Loads mental health data, drops missing, renames cols
         '''
-        # Drop missing values
-        self._df = self._df.dropna()
-        # Rename columns with weird names
-        self._df = self._df.rename(columns={'SPHSERVICE': 'PSYCH HOSP', 'CMPSERVICE': 'COMM MENTAL HEALTH CENTER'})
-        self._df = self._df.rename(columns={'OPISERVICE': 'PSYCH INPATIENT', 'RTCSERVICE': 'RES TREATMENT', 'IJSSERVICE': 'JUSTICE SYSTEM'})
-        self._df = self._df.rename(columns={'MH1': 'DIAGNOSIS 1', 'MH2': 'DIAGNOSIS 2', 'MH3': 'DIAGNOSIS 3', 'SAP': 'SUBSTANCE PROBLEM'})
-        self._df = self._df.rename(columns={'DETNLF': 'NOT LABOR FORCE', 'LIVARAG': 'RESIDENTIAL STATUS', 'NUMMHS': 'DIAGNOSES NUM'})
+        # Drop missing values, then go back to the compact numpy dtypes
+        self._df = load_data.downcast(self._df.dropna())
+        # an extra DISORDERS column with all 13 flags in one uint16; the flag columns
+        # stay, so it only saves memory when loaded on its own, as comorbidity does
+        if set(load_data.FLAGS).issubset(self._df.columns):
+            self._df[load_data.FLAG_COLUMN] = load_data.pack_flags(self._df)
+        # Rename columns with weird names, all at once so the frame is only copied once
+        self._df = self._df.rename(columns=RENAMED_COLUMNS)
         
         return self._df
 
 
+    @instrument.timed
+    def aggregates(self, df):
+        '''
+        disorder counts for every dimension, computed in one pass over df
+        shared by all of the groupby methods below
+        when streaming there is no df, and the precomputed aggregates are used
+        '''
+        if df is not None and df is not self._aggregated:
+            self._aggregates = DisorderAggregates.from_frame(df)
+            self._aggregated = df
+        return self._aggregates
+
+
+    @instrument.timed
     def scrape(self, pdf):
         '''
-        uses tabula library
-        scrapes tables from pdfs
-        getting info out of metadata to join to df
+        gets the Value/Label table from a metadata pdf to join to df
+        codebook tables come from the compiled registry (codebook.json),
+        tabula is never started here, only by python cli.py rebuild-codebook
         '''
-        data = read_pdf(pdf, pages = '1')
-        return data[0]
+        if pdf not in codebook.PDF_TABLES:
+            raise ValueError(pdf + ' is not one of the codebook tables ' + str(list(codebook.PDF_TABLES)))
+        return codebook.table(codebook.PDF_TABLES[pdf])
 
 
+    @instrument.timed
     def join_data_geo(self, states):
         '''
-        scrapes state names from metadata pdf
-        joins state names with mental health data
+        joins state names and shapes with mental health data
         '''
-        # scrape both pages of metadata doc to get state names
-        states_pg_1 = self.scrape('StatesP1.pdf')
-        states_pg_2 = self.scrape('States Doc Page 2.pdf')
-        # join two tables together
-        states_id = pd.concat([states_pg_1, states_pg_2], ignore_index=True, axis=0)
-        states_id = states_id[['Value', 'Label']]
+        # the shapes are keyed by FIPS code, so no name lookup is needed to join them
+        # alaska and hawaii are already left out
         gdf = self.geospatial()
-
-        # merge the scraped data, the mental health data, and the geo data
-        merged_step1 = states.merge(states_id, left_on='STATEFIP', right_on='Value', how='left')
-        merged_geo = merged_step1.merge(gdf, left_on='Label', right_on='NAME', how='left')
+        merged_geo = states.merge(gdf, left_on='STATEFIP', right_on='STATEFIP', how='inner')
         merged_geo = gpd.GeoDataFrame(merged_geo, geometry='geometry').dropna()
-        merged_geo = merged_geo[(merged_geo['NAME'] != 'Alaska') & (merged_geo['NAME'] != 'Hawaii')]
-        del merged_geo['Label']
-        del merged_geo['Value']
         return merged_geo
 
 
+    @instrument.timed
     def marital_data(self, df):
         '''
         Scrapes marital status info from metadata
@@ -70,28 +100,15 @@ class DataPrep:
         mar = mar.drop(labels=4, axis=0)
 
         # groupby marital status
-        marital_groupby = df.groupby('MARSTAT').aggregate({'ANXIETYFLG':'sum','ADHDFLG':'sum','DEPRESSFLG':'sum',
-                                                    'SCHIZOFLG':'sum','TRAUSTREFLG':['sum','count']})
-        marital_groupby.columns = ['ANXIETY','ADHD','DEPRESS','SCHIZO','TRAUMA','TOTAL']
+        marital_groupby = self.aggregates(df).table('MARSTAT')
         # merge groupby with scraped
         mar_merged = mar.merge(marital_groupby, left_on='Value', right_on='MARSTAT', how='left')
-    
-        disorders = {'ANXIETY':'Anxiety', 
-                 'DEPRESS': 'Depression', 
-                 'SCHIZO': 'Schizophrenia',
-                 'TRAUMA': 'Trauma', 
-                 'ADHD':'ADHD'}
-
-        # for each disorder, calculate the percent it makes up of the total caseload
-        for (disorder, name) in disorders.items():
-            mar_merged[disorder + '_PERCENT'] = mar_merged[disorder] / mar_merged['TOTAL']
-            del mar_merged[disorder]
-        del mar_merged['TOTAL']
-        del mar_merged['Value']
 
-        return mar_merged
+        # the percent each disorder makes up of the total caseload, in place of its count
+        return _percents(mar_merged).drop(columns=['Value'])
 
 
+    @instrument.timed
     def age_data(self,df):
         '''
         scrape age metadata
@@ -99,10 +116,7 @@ class DataPrep:
         join data together
         '''
         # group main dataset by Age
-        age =df.groupby('AGE').aggregate({'ANXIETYFLG':'sum','ADHDFLG':'sum','DEPRESSFLG':'sum',
-                                                'SCHIZOFLG':'sum','TRAUSTREFLG':['sum','count']})
-        # flatten multi-index
-        age.columns = ['ANXIETY','ADHD','DEPRESS','SCHIZO','TRAUMA','TOTAL']
+        age = self.aggregates(df).table('AGE')
 
         # scrape age metadata
         age_doc = self.scrape('age.pdf')
@@ -115,6 +129,7 @@ class DataPrep:
         return age_merged
 
 
+    @instrument.timed
     def employment_data(self, df):
         '''
         scrape employment metadata
@@ -124,9 +139,7 @@ class DataPrep:
         employ = self.scrape('employment.pdf')
 
         # groupby employment
-        employed_merge = df.groupby('EMPLOY').aggregate({'ANXIETYFLG':'sum','ADHDFLG':'sum','DEPRESSFLG':'sum',
-                                              'SCHIZOFLG':'sum','TRAUSTREFLG':['sum','count']})
-        employed_merge.columns = ['ANXIETY','ADHD','DEPRESS','SCHIZO','TRAUMA','TOTAL']
+        employed_merge = self.aggregates(df).table('EMPLOY')
         employ = employ.merge(employed_merge, right_on='EMPLOY', left_on='Value', how='left')
 
         # filter dataframe to only include 'employed' status
@@ -144,6 +157,7 @@ class DataPrep:
         return emp_final
 
 
+    @instrument.timed
     def groupby_education(self, df):
         '''
         group data by education for plotting
@@ -151,10 +165,7 @@ class DataPrep:
         '''
         educ = self.scrape('education.pdf')
         # groupby education 
-        education_groupby = df.groupby('EDUC').aggregate({'ANXIETYFLG':'sum','ADHDFLG':'sum','DEPRESSFLG':'sum',
-                                              'SCHIZOFLG':'sum','TRAUSTREFLG':['sum','count']})
-        # flatten multiindex 
-        education_groupby.columns = ['ANXIETY','ADHD','DEPRESS','SCHIZO','TRAUMA','TOTAL']
+        education_groupby = self.aggregates(df).table('EDUC')
 
         edu_merged = educ.merge(education_groupby, left_on='Value', right_on='EDUC', how='left')
         # delete unecessary columns
@@ -166,72 +177,58 @@ class DataPrep:
         return edu_merged
 
 
+    @instrument.timed
     def load_urb_data(self, merged_geo):
         '''
         read a csv file with urbanization data
         filter to include relevant columns
-        rename columns
+        key it by state and join it to the main dataset
         '''
         urb = pd.read_csv('US_violent_crime.csv')
         urb = urb.rename(columns={'Unnamed: 0': 'State'})[['State', 'UrbanPop']]
-        merged_urb = merged_geo.merge(urb, left_on='NAME', right_on='State', how='left')
+        urb = state_table.to_fips(urb, 'State', 'US_violent_crime.csv')
+        merged_urb = state_table.join(merged_geo, urb, 'US_violent_crime.csv')
         return merged_urb
 
 
+    @instrument.timed
     def education_percentage(self, df):
         '''
         Groupby education
         Process data to allow plotting by percentage
         '''
-        # scrape metadata to get categorical labels
+        # look up metadata to get categorical labels
         educ_levels = self.scrape('education.pdf')
         # groupby education levels
-        education_groupby = df.groupby('EDUC').aggregate({'ANXIETYFLG':'sum','ADHDFLG':'sum','DEPRESSFLG':'sum',
-                                              'SCHIZOFLG':'sum','TRAUSTREFLG':['sum','count']})
-        # flatten multiindex by renaming columns
-        education_groupby.columns = ['ANXIETY','ADHD','DEPRESS','SCHIZO','TRAUMA','TOTAL']
-        # create dict with disorder names to make it easy to loop through 
-        disorders = disorders = {'ANXIETY':'Anxiety', 
-                 'DEPRESS': 'Depression', 
-                 'SCHIZO': 'Schizophrenia',
-                 'TRAUMA': 'Trauma', 
-                 'ADHD':'ADHD'}
-
+        education_groupby = self.aggregates(df).table('EDUC')
         # merge groupby with the scraped labels
-        edu_merged_percent = educ_levels = self.scrape('education.pdf').merge(education_groupby, left_on='Value', right_on='EDUC', how='left')
-        # for each disorder, add a column computing % of total caseload
-        for (disorder, name) in disorders.items():
-            edu_merged_percent[disorder + '_PERCENT'] = edu_merged_percent[disorder] / edu_merged_percent['TOTAL']
-            del edu_merged_percent[disorder]
-        # delete unnecessary columns
-        del edu_merged_percent['Value']
-        del edu_merged_percent['TOTAL']
+        edu_merged_percent = educ_levels.merge(education_groupby, left_on='Value', right_on='EDUC', how='left')
+        # % of total caseload for each disorder, in place of its count
+        edu_merged_percent = _percents(edu_merged_percent).drop(columns=['Value'])
         edu_merged_percent = edu_merged_percent.drop(labels=0, axis=0)
         
         return edu_merged_percent
 
 
+    @instrument.timed
     def groupby_state(self,df):
         '''
         group main dataframe by state
         results in a dataset with 50ish rows
         '''
-        states =df.groupby('STATEFIP').aggregate({'ANXIETYFLG':'sum','ADHDFLG':'sum','DEPRESSFLG':'sum',
-                                              'SCHIZOFLG':'sum','TRAUSTREFLG':['sum','count']})
-        states.columns = ['ANXIETY','ADHD','DEPRESS','SCHIZO','TRAUMA','TOTAL']
+        states = self.aggregates(df).table('STATEFIP')
         return states
 
 
+    @instrument.timed
     def geospatial(self):
         '''
-        read and filter geodata
-        remove alaska and hawaii for graph purposes
+        state names and simplified outlines, keyed by STATEFIP
+        alaska and hawaii are removed for graph purposes
         '''
-        gdf = gpd.read_file('united_states.json')
-        country = gdf[(gdf['NAME'] != 'Alaska') & (gdf['NAME'] != 'Hawaii')]
-        gdf = gdf[['NAME', 'geometry']]
-        return gdf
+        return geometry.state_shapes()
 
+    @instrument.timed
     def crime_data(self, merged_urb):
         '''
         load dataset with info about crime
@@ -243,9 +240,9 @@ class DataPrep:
         crime['Crimes Number'] = crime['Data.Totals.Property.All'] + crime['Data.Totals.Violent.All']
         crime = crime[['State', 'Year', 'Crime Rate', 'Crimes Number']]
         crime = crime[crime['Year'] == 2019]
+        crime = state_table.to_fips(crime, 'State', 'state_crime.csv')
 
-        crime_merged = merged_urb.merge(crime, left_on='NAME', right_on='State', how='left')
-        
+        crime_merged = state_table.join(merged_urb, crime, 'state_crime.csv')
         return crime_merged
     
 
@@ -0,0 +1,69 @@
+import numpy as np
+import scipy.sparse as sp
+import codebook
+
+
+class FeatureEncoder:
+    '''
+    One-hot encodes integer code columns straight into a sparse CSR matrix,
+    without building dense dummy columns or decoding the codes to strings.
+    The levels of each column come from the codebook, so every slice of
+    the data (or a new file) is encoded into the same columns.
+    '''
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.levels = {col: sorted(codebook.labels(col)) for col in self.columns}
+        self.codebook_version = codebook.version()
+
+
+    def feature_names(self):
+        return [col + '_' + str(level) for col in self.columns for level in self.levels[col]]
+
+
+    def _lookup(self, col, start):
+        '''
+        dense array from code (shifted by the smallest level) to output column
+        '''
+        levels = np.array(self.levels[col])
+        low = levels.min()
+        lookup = np.full(levels.max() - low + 1, -1, dtype=np.int64)
+        lookup[levels - low] = start + np.arange(len(levels))
+        return lookup, low
+
+
+    def transform(self, df):
+        '''
+        rows x one-hot columns matrix, with one nonzero per known code
+        codes that aren't in the codebook are left as all zeros
+        '''
+        n = len(df)
+        positions = np.empty((n, len(self.columns)), dtype=np.int64)
+        start = 0
+        for (i, col) in enumerate(self.columns):
+            lookup, low = self._lookup(col, start)
+            codes = df[col].to_numpy().astype(np.int64) - low
+            known = (codes >= 0) & (codes < len(lookup))
+            positions[:, i] = np.where(known, lookup[np.where(known, codes, 0)], -1)
+            start += len(self.levels[col])
+
+        rows = np.repeat(np.arange(n), len(self.columns))
+        positions = positions.ravel()
+        known = positions >= 0
+        ones = np.ones(known.sum(), dtype=np.float32)
+        return sp.csr_matrix((ones, (rows[known], positions[known])), shape=(n, start))
+
+
+    def codes(self, df):
+        '''
+        rows x columns matrix of each code's position among its column's levels,
+        the form gradient boosting takes native categories in
+        codes that aren't in the codebook are NaN
+        '''
+        codes = np.empty((len(df), len(self.columns)), dtype=np.float32)
+        for (i, col) in enumerate(self.columns):
+            lookup, low = self._lookup(col, 0)
+            values = df[col].to_numpy().astype(np.int64) - low
+            known = (values >= 0) & (values < len(lookup))
+            positions = lookup[np.where(known, values, 0)]
+            codes[:, i] = np.where(known & (positions >= 0), positions, np.nan)
+        return codes
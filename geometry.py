@@ -0,0 +1,47 @@
+import os
+import geopandas as gpd
+import load_data
+
+GEO_FILE = 'united_states.json'
+CACHE_DIR = os.path.join('.cache', 'geometry')
+# in degrees, about a kilometre, far below what a state sized map can show
+TOLERANCE = 0.01
+# left off the maps so the lower 48 aren't squeezed into a corner
+EXCLUDED_STATES = [2, 15]
+
+# shapes already loaded in this process, by (source hash, tolerance)
+_shapes = {}
+
+
+def _build(path, tolerance):
+    '''
+    reads the geojson, keys it by FIPS code and simplifies the outlines
+    '''
+    gdf = gpd.read_file(path)
+    gdf['STATEFIP'] = gdf['STATE'].astype(int)
+    gdf = gdf[~gdf['STATEFIP'].isin(EXCLUDED_STATES)]
+    gdf = gdf[['STATEFIP', 'NAME', 'geometry']].reset_index(drop=True)
+    if tolerance:
+        # topology is kept so neighbouring states still share their borders
+        gdf['geometry'] = gdf.geometry.simplify(tolerance, preserve_topology=True)
+    return gdf
+
+
+def state_shapes(path=GEO_FILE, tolerance=TOLERANCE, cache_dir=CACHE_DIR):
+    '''
+    STATEFIP, NAME and a simplified outline for each state on the maps
+    built from the geojson once, then read from a geoparquet file
+    the cache is keyed by the contents of the geojson and the tolerance
+    '''
+    digest = load_data.file_hash(path)[:12]
+    key = (digest, tolerance)
+    if key not in _shapes:
+        cache_file = os.path.join(cache_dir, 'states-' + digest + '-' + str(tolerance) + '.parquet')
+        if os.path.exists(cache_file):
+            gdf = gpd.read_parquet(cache_file)
+        else:
+            gdf = _build(path, tolerance)
+            os.makedirs(cache_dir, exist_ok=True)
+            gdf.to_parquet(cache_file, index=False)
+        _shapes[key] = gdf
+    return _shapes[key].copy()
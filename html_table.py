@@ -0,0 +1,41 @@
+import pandas as pd
+
+
+def _text(cell):
+    # text of a cell and everything in it, without surrounding whitespace
+    return ' '.join(cell.text_content().split())
+
+
+def read_table(html, match):
+    '''
+    the first table in the page with a header cell (a th, or a cell of the
+    first row) that is exactly match, as a DataFrame of cell text with its
+    first row as the header
+    only that table's rows are turned into text
+    '''
+    # only imported once there is a page to parse
+    import lxml.html
+
+    root = lxml.html.fromstring(html)
+    # the innermost table with a matching header, so layout tables around it are skipped
+    # and a note that only mentions match in its text is never taken for the data
+    tables = root.xpath('//table[.//th[normalize-space(.) = $match]'
+                        ' or (.//tr)[1]/*[self::td or self::th][normalize-space(.) = $match]]'
+                        '[not(.//table)]', match=match)
+    if not tables:
+        raise ValueError('no table with a header cell ' + repr(match))
+    rows = [[_text(cell) for cell in row.xpath('./th|./td')]
+            for row in tables[0].xpath('./tr|./thead/tr|./tbody/tr|./tfoot/tr')]
+    rows = [row for row in rows if row]
+    width = len(rows[0])
+    # rows of a different width (notes, footers) aren't part of the data
+    body = [row for row in rows[1:] if len(row) == width]
+    return pd.DataFrame(body, columns=rows[0])
+
+
+def numbers(column):
+    '''
+    a column of text like '$56,200' or '71.90°F' as numbers
+    everything but digits, the decimal point and a minus sign is dropped
+    '''
+    return pd.to_numeric(column.str.replace(r'[^\d.\-]', '', regex=True))
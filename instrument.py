@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import cProfile
+import threading
+import functools
+from contextlib import contextmanager
+import pandas as pd
+
+REPORT_FILE = os.path.join('.cache', 'run_report.json')
+PROFILE_DIR = os.path.join('.cache', 'profiles')
+# how often the memory of the process is sampled while a stage runs
+SAMPLE_SECONDS = 0.005
+
+# finished stages, in the order they started
+_records = []
+# stages that are running, the memory sampler updates their peaks
+_active = []
+_sampler = None
+# stages whose name contains one of these are profiled
+_profiled = []
+_profiler = 'cprofile'
+
+
+def _rss():
+    '''
+    current resident set size of this process in bytes,
+    or None when there is no way to read it
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        pass
+    # no /proc (mac, windows): psutil can read it, if it's installed
+    # (getrusage only has the lifetime peak, which makes the deltas meaningless)
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+def _sample():
+    while _active:
+        rss = _rss()
+        for record in list(_active):
+            if rss is not None:
+                record['_peak'] = max(record['_peak'], rss)
+        time.sleep(SAMPLE_SECONDS)
+
+
+def _start_sampler():
+    global _sampler
+    if _sampler is None or not _sampler.is_alive():
+        _sampler = threading.Thread(target=_sample, daemon=True)
+        _sampler.start()
+
+
+def profile(names, profiler='cprofile'):
+    '''
+    profiles every stage whose name contains one of names
+    profiler is 'cprofile' (a .prof file for pstats or snakeviz) or
+    'pyinstrument' (an html page, if pyinstrument is installed)
+    '''
+    global _profiled, _profiler
+    _profiled = list(names)
+    _profiler = profiler
+
+
+def _start_profile(name):
+    # only one profiler can run at a time, so stages inside a profiled one aren't profiled again
+    if not any(part in name for part in _profiled) or any('_profiler' in record for record in _active):
+        return None
+    if _profiler == 'pyinstrument':
+        from pyinstrument import Profiler
+
+        profiler = Profiler()
+        profiler.start()
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    return profiler
+
+
+def _save_profile(name, profiler):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    if _profiler == 'pyinstrument':
+        profiler.stop()
+        path = os.path.join(PROFILE_DIR, name + '.html')
+        with open(path, 'w') as f:
+            f.write(profiler.output_html())
+    else:
+        profiler.disable()
+        path = os.path.join(PROFILE_DIR, name + '.prof')
+        profiler.dump_stats(path)
+    return path
+
+
+@contextmanager
+def stage(name, rows_in=None):
+    '''
+    records the wall time, cpu time and memory of everything in the with block
+    the record is yielded so the block can fill in rows_out
+    memory is left as None where the process size can't be read
+    '''
+    rss = _rss()
+    record = {'stage': name, 'depth': len(_active), 'wall_s': None, 'cpu_s': None,
+              'rss_mb': None if rss is None else round(rss / 2 ** 20, 1), 'mem_delta_mb': None,
+              'rows_in': rows_in, 'rows_out': None, '_peak': rss}
+    _records.append(record)
+    profiler = _start_profile(name)
+    if profiler is not None:
+        record['_profiler'] = True
+    _active.append(record)
+    _start_sampler()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield record
+    finally:
+        record['wall_s'] = round(time.perf_counter() - wall, 4)
+        record['cpu_s'] = round(time.process_time() - cpu, 4)
+        _active.remove(record)
+        peak = record.pop('_peak')
+        end = _rss()
+        if rss is not None and end is not None:
+            record['mem_delta_mb'] = round((max(peak, end) - rss) / 2 ** 20, 1)
+        if profiler is not None:
+            del record['_profiler']
+            record['profile'] = _save_profile(name, profiler)
+
+
+def _rows(value):
+    # tables and arrays have rows, anything else doesn't
+    if hasattr(value, 'shape') and len(value.shape) > 0:
+        return int(value.shape[0])
+    return None
+
+
+def _name(fn):
+    module = os.path.splitext(os.path.basename(fn.__code__.co_filename))[0]
+    return module + '.' + fn.__qualname__
+
+
+def timed(fn):
+    '''
+    decorator that runs a function as a stage named module.function
+    rows_in is the size of the first table argument, rows_out the size of the result
+    '''
+    name = _name(fn)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        tables = [_rows(arg) for arg in args if _rows(arg) is not None]
+        with stage(name, tables[0] if tables else None) as record:
+            result = fn(*args, **kwargs)
+            record['rows_out'] = _rows(result)
+        return result
+    return wrapper
+
+
+def add(name, wall_s, cpu_s):
+    '''
+    adds a stage that was timed somewhere else, like in a worker process
+    it's nested under the stage that is running now
+    '''
+    _records.append({'stage': name, 'depth': len(_active), 'wall_s': round(wall_s, 4), 'cpu_s': round(cpu_s, 4),
+                     'rss_mb': None, 'mem_delta_mb': None, 'rows_in': None, 'rows_out': None})
+
+
+def records():
+    return [dict(record) for record in _records if record['wall_s'] is not None]
+
+
+def reset():
+    _records.clear()
+
+
+def summary():
+    '''
+    the stages as a table, nested stages indented under the one they ran in
+    '''
+    table = pd.DataFrame(records())
+    if table.empty:
+        return 'no stages recorded'
+    names = ['  ' * depth + name for (depth, name) in zip(table['depth'], table['stage'])]
+    width = max(len(name) for name in names)
+    table['stage'] = [name.ljust(width) for name in names]
+    for col in ['rows_in', 'rows_out']:
+        table[col] = ['' if pd.isna(rows) else str(int(rows)) for rows in table[col]]
+    columns = ['stage', 'wall_s', 'cpu_s', 'mem_delta_mb', 'rows_in', 'rows_out']
+    return table[columns].to_string(index=False, na_rep='')
+
+
+def report(path=REPORT_FILE, **info):
+    '''
+    writes the stages to a json file, along with anything in info
+    '''
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(dict(info, created=time.strftime('%Y-%m-%dT%H:%M:%S'), stages=records()), f, indent=1)
+    return path
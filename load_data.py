@@ -0,0 +1,147 @@
+import hashlib
+import io
+import os
+import numpy as np
+import pandas as pd
+
+DATA_FILE = 'mhcld-puf-2019-csv.csv'
+CHUNK_SIZE = 500000
+
+# every coded field in the codebook is -9 for missing and then 0/1..N,
+# so they all fit in a single byte
+CODED_COLUMNS = ['AGE', 'EDUC', 'ETHNIC', 'RACE', 'GENDER',
+                 'SPHSERVICE', 'CMPSERVICE', 'OPISERVICE', 'RTCSERVICE', 'IJSSERVICE',
+                 'MH1', 'MH2', 'MH3', 'SUB', 'MARSTAT', 'SMISED', 'SAP', 'EMPLOY',
+                 'DETNLF', 'VETERAN', 'LIVARAG', 'NUMMHS',
+                 'TRAUSTREFLG', 'ANXIETYFLG', 'ADHDFLG', 'CONDUCTFLG', 'DELIRDEMFLG',
+                 'BIPOLARFLG', 'DEPRESSFLG', 'ODDFLG', 'PDDFLG', 'PERSONFLG',
+                 'SCHIZOFLG', 'ALCSUBFLG', 'OTHERDISFLG',
+                 'STATEFIP', 'DIVISION', 'REGION']
+
+SCHEMA = {col: 'int8' for col in CODED_COLUMNS}
+SCHEMA['YEAR'] = 'int16'
+SCHEMA['CASEID'] = 'int64'
+
+# the 13 disorder flags, bit i of the packed DISORDERS column is FLAGS[i]
+FLAGS = [col for col in CODED_COLUMNS if col.endswith('FLG')]
+FLAG_COLUMN = 'DISORDERS'
+
+
+def _dtypes(columns, nullable=False):
+    '''
+    schema for the requested columns
+    the nullable version lets blank fields parse as <NA> until clean_df drops them
+    '''
+    if columns is None:
+        columns = SCHEMA.keys()
+    if nullable:
+        return {col: SCHEMA[col].capitalize() for col in columns if col in SCHEMA}
+    return {col: SCHEMA[col] for col in columns if col in SCHEMA}
+
+
+def _read_csv(source, columns, **kwargs):
+    '''
+    parses straight into the numpy dtypes, and only falls back to the
+    nullable ones (about ten times slower to parse) if a field is blank
+    '''
+    try:
+        return pd.read_csv(source, usecols=columns, dtype=_dtypes(columns), **kwargs)
+    except ValueError:
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        return pd.read_csv(source, usecols=columns, dtype=_dtypes(columns, nullable=True), **kwargs)
+
+
+def load(path=DATA_FILE, columns=None):
+    '''
+    reads the mental health csv using the codebook schema
+    only the requested columns are parsed
+    '''
+    return _read_csv(path, columns)
+
+
+def load_chunks(path=DATA_FILE, columns=None, chunk_size=CHUNK_SIZE):
+    '''
+    same as load, but yields frames of at most chunk_size rows
+    so the whole file never has to be in memory at once
+    '''
+    # a blank field in one chunk can't fail the whole read, so the
+    # dtypes are applied to each chunk after it's parsed
+    with pd.read_csv(path, usecols=columns, chunksize=chunk_size) as reader:
+        for chunk in reader:
+            yield chunk.astype(_dtypes(chunk.columns, nullable=chunk.isna().any().any()))
+
+
+def pack_flags(df, flags=FLAGS):
+    '''
+    packs the 0/1 disorder flags of each row into one uint16 bitmask,
+    with bit i set when flags[i] is 1
+    '''
+    bits = np.zeros(len(df), dtype=np.uint16)
+    for (bit, flag) in enumerate(flags):
+        bits |= (df[flag].to_numpy() == 1).astype(np.uint16) << bit
+    return bits
+
+
+def unpack_flags(bits, flags=FLAGS):
+    '''
+    the 0/1 flag columns back out of the bitmask
+    '''
+    bits = np.asarray(bits)
+    return pd.DataFrame({flag: ((bits >> bit) & 1).astype('int8') for (bit, flag) in enumerate(flags)})
+
+
+def file_hash(path):
+    '''
+    sha256 of a file, read in blocks so big csvs don't need to fit in memory
+    '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def header(path):
+    '''
+    column names from the first line of the csv
+    '''
+    with open(path, 'rb') as f:
+        return f.readline().decode('utf-8-sig').strip().split(',')
+
+
+def byte_ranges(path, parts):
+    '''
+    splits the rows of the csv into about `parts` (start, end) byte ranges
+    every range starts at the beginning of a line, after the header
+    '''
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        f.readline()
+        bounds = [f.tell()]
+        first = bounds[0]
+        for part in range(1, parts):
+            f.seek(max(first + (size - first) * part // parts, bounds[-1]))
+            # move to the start of the next line
+            f.readline()
+            bounds.append(f.tell())
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def load_range(path, start, end, columns=None):
+    '''
+    same as load, but only for the rows in the byte range [start, end)
+    '''
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return _read_csv(io.BytesIO(data), columns, header=None, names=header(path))
+
+
+def downcast(df):
+    '''
+    converts the nullable columns back to plain numpy dtypes
+    only valid once missing values have been dropped
+    '''
+    return df.astype({col: SCHEMA[col] for col in df.columns if col in SCHEMA})
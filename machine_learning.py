@@ -1,63 +1,113 @@
+import os
+import sys
+import time
+import itertools
+import numpy as np
 import pandas as pd
-from tabula import read_pdf
+import joblib
+import sklearn
+from joblib import Parallel, delayed
 from sklearn.tree import DecisionTreeClassifier
-from sklearn.model_selection import train_test_split
+from sklearn.ensemble import HistGradientBoostingClassifier
+from sklearn.model_selection import train_test_split, KFold
 from sklearn.metrics import accuracy_score
+import load_data
+import data_cache
+import codebook
+from features import FeatureEncoder
+
+FEATURE_COLUMNS = ['AGE', 'EMPLOY', 'EDUC', 'RACE', 'MARSTAT', 'REGION']
+# only feasible now that the one-hot matrix is sparse
+EXTRA_FEATURE_COLUMNS = ['GENDER', 'ETHNIC', 'STATEFIP', 'SMISED']
+# a decision tree on one-hot columns, or gradient boosted trees on the codes as categories
+MODELS = ['tree', 'boosting']
+# processes the folds are fitted on, -1 is every core
+N_JOBS = -1
+# the trained model, with everything needed to score new data
+MODEL_FILE = os.path.join('models', 'mh1.joblib')
+SCORE_CHUNK_SIZE = 100000
+# hyperparameters tried by the successive halving search, for each model family
+SEARCH_SPACE = {'tree': {'max_depth': [4, 8, 12, 16, None], 'min_samples_leaf': [1, 10, 100, 1000],
+                         'class_weight': [None, 'balanced']},
+                'boosting': {'max_depth': [3, 6, None], 'min_samples_leaf': [20, 200, 2000],
+                             'class_weight': [None, 'balanced']}}
+# every fit the last search made, with its time versus accuracy curve
+SEARCH_FILE = os.path.join('.cache', 'search.csv')
+# the fewest rows a candidate is ever fitted on, and the most it's scored on
+MIN_ROWS = 500
+VALIDATION_ROWS = 10000
 
 def scrape_tables():
     """
-    Scrape each table in each of the 6 documentation pdfs.
+    Look up the table for each of the 6 features in the codebook registry.
     This will match the code to its string equivlent.
     Put this in a list of tables to merge with the mental health dataset.
     """
     scraped_tables = list()
 
-    # make a list of the pdf names.
-    # utilize a list. the only difference is the pdf name so pass in each one.
-    file_names = ['region.pdf', 'marstat.pdf', 'race.pdf', 'education.pdf', 'employment.pdf', 'age.pdf']
-    for file in file_names:
-        table = read_pdf(file, pages = '1')[0][['Value', 'Label']]
+    # the registry has the same tables the 6 documentation pdfs had
+    variables = ['REGION', 'MARSTAT', 'RACE', 'EDUC', 'EMPLOY', 'AGE']
+    for variable in variables:
+        table = codebook.table(variable)[['Value', 'Label']]
         scraped_tables.append(table)
     return scraped_tables
 
 
-def scrape_labels(labels):
+def merge_features(scraped_tables, features, decode=True):
     """
-    Same scraping and merging as the features, but for the label column only.
+    Replace each code column with its string label from the scraped tables.
+    Each column is decoded by indexing into a lookup array, so the feature
+    frame is built once instead of merged and copied for every column.
+    With decode=False the codes are only marked as categories, which is all
+    one-hot encoding needs.
     """
-    disorders = read_pdf('mh1.pdf', pages = '1')[0][['Value', 'Label']]
-
-    labels = labels.merge(disorders, left_on='MH1', right_on='Value', how='left')
-    labels = labels.rename(columns={'MH1':'dummy', 'Label': 'MH1'})
-    labels = labels['MH1']
+    old_columns = ['REGION', 'MARSTAT', 'RACE', 'EDUC', 'EMPLOY', 'AGE']
 
-    return labels
+    decoded = {}
+    for featurenum in range(6):
+        old_column = old_columns[featurenum]
+        if decode:
+            scraped_table = scraped_tables[featurenum].dropna(subset=['Value'])
+            lookup = dict(zip(scraped_table['Value'].astype(int), scraped_table['Label']))
+            decoded[old_column] = codebook.decode(features[old_column], lookup)
+        else:
+            decoded[old_column] = pd.Categorical(features[old_column])
+    # the other columns first, then the decoded ones, like the old merges left them
+    others = features.loc[:, ~features.columns.isin(old_columns)]
+    return others.assign(**decoded)
 
 
-def merge_features(scraped_tables, features):
+def model_features(df, feature_columns, model='tree', encoder=None):
     """
-    The tables with the feature strings must be merged and filtered into the main
-    dataset. Only the column name and scraped table changes, so leverage a loop
-    to merge and filer all.
+    The feature matrix for a model: sparse one-hot columns for the tree,
+    codes renumbered 0..levels-1 for boosting, which is what histogram
+    gradient boosting needs to split on them as native categories. A saved encoder can be passed in so new
+    data is encoded with the levels the model was trained on.
     """
-    old_columns = ['REGION', 'MARSTAT', 'RACE', 'EDUC', 'EMPLOY', 'AGE']
+    if encoder is None:
+        encoder = FeatureEncoder(feature_columns)
+    if model == 'boosting':
+        return encoder.codes(df)
+    return encoder.transform(df)
 
-    for featurenum in range(6):
-        scraped_table = scraped_tables[featurenum]
-        old_column = old_columns[featurenum]
-        features = features.merge(scraped_table, left_on=old_column, right_on='Value', how='left')
-        features = features.rename(columns={old_column:'dummy', 'Label': old_column})
-        features = features.loc[:,features.columns != 'Value']
-        features = features.loc[:,features.columns != 'dummy']
-    return features
 
+def make_model(model='tree', columns=None, params=None):
+    """
+    An unfitted classifier, with any hyperparameters in params.
+    Every column given to boosting is categorical.
+    """
+    params = params or {}
+    if model == 'boosting':
+        return HistGradientBoostingClassifier(categorical_features=[True] * columns, **params)
+    return DecisionTreeClassifier(**params)
 
-def train_the_model(features_train, labels_train):
+
+def train_the_model(features_train, labels_train, model='tree', params=None):
     """
     Decision Tree Classifier since we are predicting categorical
     data (which mental health disorder).
     """
-    model = DecisionTreeClassifier()
+    model = make_model(model, features_train.shape[1], params)
     model.fit(features_train, labels_train)
 
     # Test
@@ -74,32 +124,255 @@ def test_the_model(model, features_test, labels_test):
     test_score = accuracy_score(labels_test, tested_predictions)
     return test_score
 
-def main():
-    df = pd.read_csv('mhcld-puf-2019-csv.csv')
-    # Drop missing values
-    df = df.dropna()
+def _fit_fold(model, features, labels, train_rows, test_rows, fold, params=None):
+    """
+    Fit and score one fold, timing both.
+    """
+    start = time.perf_counter()
+    fitted = make_model(model, features.shape[1], params).fit(features[train_rows], labels[train_rows])
+    fit_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    predictions = fitted.predict(features[test_rows])
+    predict_seconds = time.perf_counter() - start
+    return {'fold': fold, 'train_rows': len(train_rows), 'test_rows': len(test_rows),
+            'accuracy': accuracy_score(labels[test_rows], predictions),
+            'fit_s': fit_seconds, 'fit_rows_per_s': len(train_rows) / fit_seconds,
+            'predict_s': predict_seconds, 'predict_rows_per_s': len(test_rows) / predict_seconds}
+
+
+def cross_validate(features, labels, model='tree', folds=5, n_jobs=N_JOBS, seed=None):
+    """
+    K-fold cross validation, with the folds fitted in parallel on n_jobs
+    processes (every core by default, 1 fits them one after another). Only held out rows are scored, and each
+    fold's fit and predict times and rows per second are reported.
+    """
+    splits = KFold(folds, shuffle=True, random_state=seed).split(np.arange(len(labels)))
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(_fit_fold)(model, features, labels, train_rows, test_rows, fold)
+        for (fold, (train_rows, test_rows)) in enumerate(splits))
+    return pd.DataFrame(results).set_index('fold')
+
+
+def candidates(space=SEARCH_SPACE):
+    """
+    Every combination of hyperparameters for every model family, as
+    dicts with the family under 'model'.
+    """
+    configs = []
+    for (model, grid) in space.items():
+        for values in itertools.product(*grid.values()):
+            configs.append(dict(zip(grid, values), model=model))
+    return configs
+
+
+def config_params(config):
+    """
+    The hyperparameters of a search config, without its model family.
+    """
+    return {name: value for (name, value) in config.items() if name != 'model'}
+
+
+def stratified_order(labels, seed=None):
+    """
+    Shuffle the row numbers so that every prefix has about the same share
+    of each class as the whole, which makes each larger subsample of the
+    search a longer prefix of the same order.
+    """
+    rng = np.random.default_rng(seed)
+    shuffled = rng.permutation(len(labels))
+    _, classes, counts = np.unique(labels[shuffled], return_inverse=True, return_counts=True)
+    # each row's position within its class, as a fraction of the class
+    by_class = np.argsort(classes, kind='stable')
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    fraction = np.empty(len(labels))
+    fraction[by_class] = (np.arange(len(labels)) - starts + 0.5) / np.repeat(counts, counts)
+    return shuffled[np.argsort(fraction, kind='stable')]
+
+
+def successive_halving(matrices, labels, rows, configs=None, factor=3, min_rows=None,
+                       validation=VALIDATION_ROWS, n_jobs=N_JOBS, seed=None):
+    """
+    Successive halving search over the configs. Every config is fitted on
+    a small stratified subsample of rows, only the best 1/factor go on to
+    factor times as many rows, and so on until one is left or every row is
+    used. min_rows defaults to the size that makes the last round use all
+    of them. Each round's fits run in parallel on n_jobs processes (every
+    core by default, 1 fits them one after another) and are all scored on
+    the same held out rows: a fifth of the rows, up to validation of them,
+    since scoring every candidate is what costs the most on small budgets.
+    matrices maps each model family to its feature matrix.
+    Returns the winning config, and every fit with the seconds since the
+    search started and the best accuracy so far: the time versus accuracy curve.
+    """
+    if configs is None:
+        configs = candidates()
+    order = rows[stratified_order(labels[rows], seed)]
+    validation_rows, pool = np.split(order, [min(len(order) // 5, validation)])
+    if min_rows is None:
+        rounds = int(np.ceil(np.log(len(configs)) / np.log(factor)))
+        min_rows = max(MIN_ROWS, len(pool) // factor ** rounds)
+
+    start = time.perf_counter()
+    results = []
+    survivors = list(range(len(configs)))
+    budget = min_rows
+    for search_round in itertools.count():
+        budget_rows = pool[:budget]
+        fits = Parallel(n_jobs=n_jobs)(
+            delayed(_fit_fold)(configs[i]['model'], matrices[configs[i]['model']], labels,
+                               budget_rows, validation_rows, i, config_params(configs[i]))
+            for i in survivors)
+        elapsed = time.perf_counter() - start
+        for fit in fits:
+            results.append({'round': search_round, 'candidate': fit['fold'], **configs[fit['fold']],
+                            'rows': fit['train_rows'], 'accuracy': fit['accuracy'],
+                            'fit_s': fit['fit_s'], 'predict_s': fit['predict_s'],
+                            'elapsed_s': elapsed})
+
+        fits.sort(key=lambda fit: fit['accuracy'], reverse=True)
+        if len(survivors) == 1 or budget >= len(pool):
+            break
+        survivors = [fit['fold'] for fit in fits[:-(-len(survivors) // factor)]]
+        budget *= factor
+
+    results = pd.DataFrame(results)
+    results['best_accuracy'] = results['accuracy'].cummax()
+    return (configs[fits[0]['fold']], results)
+
+
+def split_rows(n, test_size=0.3):
+    """
+    Split row numbers instead of frames, so the data is only copied
+    once, when each side is taken out of the feature matrix.
+    """
+    return train_test_split(np.arange(n), test_size=test_size)
+
+
+def save_model(path, model, encoder, kind):
+    """
+    Save the fitted model together with the encoder that made its features
+    and the codebook version the encoder's levels came from, so new data is
+    encoded into exactly the columns the model was trained on.
+    """
+    artifact = {'model': model, 'kind': kind, 'encoder': encoder,
+                'feature_columns': encoder.columns, 'classes': list(model.classes_),
+                'codebook_version': encoder.codebook_version,
+                'sklearn_version': sklearn.__version__}
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    joblib.dump(artifact, path)
+
+
+def load_model(path=MODEL_FILE):
+    """
+    Load a saved model. The encoder keeps its own levels, so a newer codebook
+    or sklearn only gets a warning instead of silently changing the features.
+    """
+    artifact = joblib.load(path)
+    if artifact['codebook_version'] != codebook.version():
+        print('Warning:', path, 'was trained with codebook version', artifact['codebook_version'],
+              'but codebook.json is version', codebook.version())
+    if artifact['sklearn_version'] != sklearn.__version__:
+        print('Warning:', path, 'was saved by sklearn', artifact['sklearn_version'],
+              'and is being loaded by', sklearn.__version__)
+    return artifact
+
+
+def score(path, output, model_path=MODEL_FILE, chunk_size=SCORE_CHUNK_SIZE):
+    """
+    Predict MH1 for every row of a csv with a saved model. The csv is
+    streamed chunk_size rows at a time, so it never has to fit in memory,
+    and each chunk is written out with CASEID (when the file has it), the
+    predicted code and the probability of every class. Missing feature
+    values are scored as the codebook's -9 (missing) code so every row
+    gets a prediction. Returns the rows scored and records per second,
+    overall and for encoding plus predicting alone.
+    """
+    artifact = load_model(model_path)
+    columns = artifact['feature_columns']
+    classes = np.array(artifact['classes'])
+    ids = [col for col in ['CASEID'] if col in load_data.header(path)]
 
-    # Grab initial "features" and "labels"
-    features = df[['AGE', 'EMPLOY', 'EDUC', 'RACE', 'MARSTAT', 'REGION']]
-    # Make labels a DataFrame instead of Series to merge later
-    labels = pd.DataFrame(df['MH1'])
+    rows = 0
+    model_seconds = 0
+    start = time.perf_counter()
+    with open(output, 'w', newline='') as f:
+        for chunk in load_data.load_chunks(path, ids + columns, chunk_size):
+            model_start = time.perf_counter()
+            features = model_features(chunk[columns].fillna(-9), columns, artifact['kind'],
+                                      artifact['encoder'])
+            probabilities = artifact['model'].predict_proba(features)
+            model_seconds += time.perf_counter() - model_start
 
-    # Scrape and replace the features and labels
-    labels = scrape_labels(labels)
-    scraped_tables = scrape_tables()
-    features_new = merge_features(scraped_tables, features) 
+            scored = pd.DataFrame(probabilities, columns=['P_' + str(c) for c in classes])
+            scored.insert(0, 'PREDICTED_MH1', classes[probabilities.argmax(axis=1)])
+            if ids:
+                scored.insert(0, 'CASEID', chunk['CASEID'].to_numpy())
+            scored.to_csv(f, header=rows == 0, index=False, float_format='%.4f')
+            rows += len(chunk)
+    seconds = time.perf_counter() - start
 
-    # Finally, one-hot encode to prepare final features for ML
-    features_new = pd.get_dummies(features_new)
-    features_train, features_test, labels_train, labels_test = train_test_split(features_new, labels, test_size=0.3)
+    stats = {'rows': rows, 'seconds': seconds, 'rows_per_s': rows / seconds,
+             'model_seconds': model_seconds, 'model_rows_per_s': rows / max(model_seconds, 1e-9)}
+    print('Scored', rows, 'rows into', output, 'in', round(seconds, 2), 's:',
+          int(stats['rows_per_s']), 'records/s,', int(stats['model_rows_per_s']),
+          'records/s encoding and predicting')
+    return stats
+
+
+def main(feature_columns=FEATURE_COLUMNS, model='tree', folds=None, n_jobs=N_JOBS, save=MODEL_FILE,
+         search=False):
+    # cleaned data (missing values dropped, MH1 renamed to DIAGNOSIS 1)
+    df = data_cache.load_clean(load_data.DATA_FILE, columns=feature_columns + ['DIAGNOSIS 1'])
+
+    # One-hot encode the int8 codes straight into a sparse matrix (or renumber
+    # them as categories for boosting). The trees work on the MH1 codes
+    # directly, so nothing needs decoding to strings
+    encoder = FeatureEncoder(feature_columns)
+    features = model_features(df, feature_columns, model, encoder)
+    labels = df['DIAGNOSIS 1'].to_numpy()
+
+    if folds:
+        scores = cross_validate(features, labels, model, folds, n_jobs)
+        print(scores.round(3).to_string())
+        print('Cross validated accuracy:', round(scores['accuracy'].mean(), 4),
+              '+/-', round(scores['accuracy'].std(), 4))
+        return scores
+
+    train_rows, test_rows = split_rows(len(df))
+    params = None
+    if search:
+        # every family is searched, each on its own encoding of the same rows
+        matrices = {kind: model_features(df, feature_columns, kind, encoder) for kind in MODELS}
+        best, results = successive_halving(matrices, labels, train_rows, n_jobs=n_jobs)
+        os.makedirs(os.path.dirname(SEARCH_FILE), exist_ok=True)
+        results.to_csv(SEARCH_FILE, index=False)
+        curve = results.groupby('round').agg(candidates=('candidate', 'size'), rows=('rows', 'max'),
+                                             best_accuracy=('best_accuracy', 'max'),
+                                             elapsed_s=('elapsed_s', 'max'))
+        print(curve.round(3).to_string())
+        print('Best:', best, '(every fit is in ' + SEARCH_FILE + ')')
+        model = best['model']
+        params = config_params(best)
+        features = matrices[model]
+
+    features_train, features_test = features[train_rows], features[test_rows]
+    labels_train, labels_test = labels[train_rows], labels[test_rows]
 
     # ML Model
-    model, train_accuracy = train_the_model(features_train, labels_train)
+    kind = model
+    model, train_accuracy = train_the_model(features_train, labels_train, model, params)
     print('Train accuracy:', train_accuracy)
 
     test_accuracy = test_the_model(model, features_test, labels_test)
     print('Test Accuracy:', test_accuracy)
+    if save:
+        save_model(save, model, encoder, kind)
+        print('Saved the model to', save)
     
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    # the same as python cli.py train
+    import cli
+
+    cli.main(['train'] + sys.argv[1:])
@@ -1,83 +1,67 @@
+import sys
 import pandas as pd
-import geopandas as gpd
-import seaborn as sns
-import matplotlib.pyplot as plt
-from tabula import read_pdf
 from data_prep import DataPrep
+from render import FigureJob
+import render
+import load_data
+import data_cache
+import aggregate
+import scrape_cache
 import scrape_weather
 import scrape_income
+import providers
+import states
+import instrument
+import metrics
 
+# only the columns the report actually uses
+REPORT_COLUMNS = ['YEAR', 'AGE', 'EDUC', 'MARSTAT', 'EMPLOY', 'STATEFIP',
+                  'ANXIETYFLG', 'ADHDFLG', 'DEPRESSFLG', 'SCHIZOFLG', 'TRAUSTREFLG']
 
-def plot_geospatial(merged_geo):
-    '''
-    Create a geospatial plot for each disorder
-    Plot cases as both a number, and a percent
-    '''
-    disorders = {'ANXIETY':'Anxiety', 
-                 'DEPRESS': 'Depression', 
-                 'SCHIZO': 'Schizophrenia',
-                 'TRAUMA': 'Trauma', 
-                 'ADHD':'ADHD'}
-    # loop through to create a plot for each disorder
-    for (disorder, name) in disorders.items():
-        # lay plots side-by-side
-        fig, [ax1, ax2] = plt.subplots(1,2, figsize=(15, 5))
-        merged_geo.plot(column = disorder, legend=True, ax=ax1)
-        ax1.set_title('Reported Cases of ' + name + ' by State')
-        
-
-        merged_geo[disorder + '_PERCENT'] = merged_geo[disorder] / merged_geo['TOTAL']
-        merged_geo.plot(column = disorder + '_PERCENT', legend=True, ax=ax2)
-        ax2.set_title('Percent ' + name)
-        fig.savefig(name + 'geospatial.png')
+DISORDERS = metrics.DISORDERS
+# per state rates and confidence intervals of every disorder
+STATE_RATES_FILE = 'state_rates.csv'
 
 
-def plot_education(edu_merged):
-    '''
-    Create a plot showing whether education level correlates with MH disorder prevalence 
-    '''
-    fig, ax = plt.subplots(1)
-    edu_merged.plot(kind='bar', stacked=True, ax=ax, legend=True)   
-    # manually ajust labels     
-    labels = ['Sp Edu', '0 to 8', '9 to 11', 'HS Diploma', 'College']
-    ax.set_xticklabels(labels, fontsize=11)
-    plt.xticks(rotation = 0)
-    plt.legend(loc='upper left')
-    plt.xlabel('Education Level')
-    plt.ylabel('# of Reported Cases')
-    plt.title('Education Level vs Total Number of Reported Cases')  
+def _draw_geospatial(fig, merged_geo, disorder, name):
+    # lay plots side-by-side
+    ax1, ax2 = fig.subplots(1, 2)
+    merged_geo.plot(column = disorder, legend=True, ax=ax1)
+    ax1.set_title('Reported Cases of ' + name + ' by State')
 
+    merged_geo.plot(column = disorder + '_PERCENT', legend=True, ax=ax2)
+    ax2.set_title('Percent ' + name)
 
 
-def plot_employment(employ_data):
+def _draw_regplot(fig, data, x, y, xlabel, ylabel, title):
     '''
-    Create a plot showing whether employment correlates with MH disorder prevalence 
+    scatter plot with a regression line
     '''
+    import seaborn as sns
+
+    ax = fig.subplots()
+    sns.regplot(x=x, y=y, data=data, ax=ax)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+
+
+def _draw_employment(fig, employ_data):
     # Make stacked bar-plot for easy comparison
-    fig, ax = plt.subplots(1)
+    ax = fig.subplots()
     employ_data.plot(kind='bar', stacked=True, ax=ax, legend=False)
     labels = ['Unemployed', 'Employed']
-    ax.set_xticklabels(labels, fontsize=11)
+    ax.set_xticklabels(labels, fontsize=11, rotation=0)
     ax.set_ylabel('Total Reported Cases')
     ax.set_xlabel('Employment Level')
-    ax.set_title('Employment Level vs Total Number of Reported Cases')  
+    ax.set_title('Employment Level vs Total Number of Reported Cases')
 
-    plt.xticks(rotation = 0)
-    plt.savefig('employment.png')
-    
 
+def _draw_weather(fig, merged_geo_weather):
+    import seaborn as sns
 
-def plot_weather(merged_geo):
-    '''
-    Create a plot showing if weather correlates with mental health disorders
-    '''
-    # get weather data
-    weather = scrape_weather.scrape()
-
-    fig, [ax1, ax2] = plt.subplots(1,2, figsize=(12, 6))
+    ax1, ax2 = fig.subplots(1, 2)
     # correlations between weather and depression/anxiety
-    merged_geo_weather = merged_geo.merge(weather, left_on='NAME', right_on='State Name', how='left')
-    del merged_geo_weather['State Name']
     sns.regplot(x='Avg Temp', y='DEPRESS', data=merged_geo_weather, ax=ax1)
     sns.regplot(x='Avg Temp', y='ANXIETY', data=merged_geo_weather, ax=ax2, color='green')
     ax1.set_ylabel('Cases of Depression', labelpad = 15, fontsize=12)
@@ -88,220 +72,276 @@ def plot_weather(merged_geo):
     ax2.set_title('Average Temperature vs Cases of Anxiety')
 
     # adjust spacing between subplots
-    plt.subplots_adjust(left=0.1, bottom=0.1, right=0.9, top=0.9, wspace=0.4, hspace=0.4)
-    fig.savefig('weather.png')
-    plt.clf()
+    fig.subplots_adjust(left=0.1, bottom=0.1, right=0.9, top=0.9, wspace=0.4, hspace=0.4)
+
+
+def _draw_age(fig, age_merged, disorder, name):
+    import seaborn as sns
+
+    ax = fig.subplots()
+    sns.barplot(x='Age Range', y=(disorder + '_PERCENT'), data=age_merged, ax=ax)
+    ax.tick_params(axis='x', labelrotation=90)
+    ax.set_ylabel('Percentage of ' + name + ' Cases')
+    ax.set_title('Percentage of ' + name + ' Cases for Each Age Group')
+
 
+def _draw_education(fig, edu_merged):
+    edu_merged = edu_merged.drop(labels=[5, 6], axis=0)
 
-def plot_income(merged_geo):
+    ax = fig.subplots()
+    # stacked plot
+    edu_merged.plot(kind='bar', stacked=True, ax=ax, legend=True)
+    # manually adjust labels
+    labels = ['Sp Edu', '0 to 8', '9 to 11', 'HS Diploma', 'College']
+    ax.set_xticklabels(labels, fontsize=11, rotation=0)
+    ax.legend(loc='upper left')
+    ax.set_ylabel('# of Total Reported Cases')
+    ax.set_title('Education Level vs Total Reported Cases')
+
+
+def _draw_education_percentage(fig, edu_merged_percent):
+    edu_merged_percent = edu_merged_percent.drop(labels=[5, 6], axis=0)
+
+    ax = fig.subplots()
+    # make stacked plot
+    edu_merged_percent.plot(kind='bar', stacked=True, ax=ax, legend=False)
+    labels = ['0 to 8', '9 to 11', 'HS Diploma', 'College']
+    ax.set_xticklabels(labels, fontsize=11, rotation=0)
+    ax.set_ylabel('Percent of Total Reported Cases')
+    ax.set_title('Education Level vs Percent of Total Reported Cases')
+
+
+@instrument.timed
+def plot_geospatial(merged_geo):
     '''
-    Create plots to show correlation between mental health & income in a state
+    Create a geospatial plot for each disorder
+    Plot cases as both a number, and a percent
+    '''
+    return [FigureJob(name + 'geospatial.png', _draw_geospatial, merged_geo, figsize=(15, 5),
+                      disorder=disorder, name=name)
+            for (disorder, name) in DISORDERS.items()]
+
+
+@instrument.timed
+def plot_employment(employ_data):
+    '''
+    Create a plot showing whether employment correlates with MH disorder prevalence 
+    '''
+    return [FigureJob('employment.png', _draw_employment, employ_data)]
+
+
+@instrument.timed
+def weather_data(merged_geo, store=None):
+    '''
+    scrape weather data and join it to the state data
+    '''
+    weather = states.to_fips(scrape_weather.scrape(store), 'State Name', 'weather')
+    return states.join(merged_geo, weather, 'weather')
+
+
+@instrument.timed
+def plot_weather(merged_geo_weather):
+    '''
+    Create a plot showing if weather correlates with mental health disorders
+    '''
+    return [FigureJob('weather.png', _draw_weather, merged_geo_weather, figsize=(12, 6))]
+
+
+@instrument.timed
+def income_data(merged_geo, store=None):
+    '''
+    scrape income data and join it to the state data
     '''
     # obtain data via webscraping
-    income = scrape_income.scrape()
-    # remove extra space at the beginning of each word
-    income['State'] = income['State'].apply(lambda s: s[1:])
-    merged_all = merged_geo.merge(income, left_on='NAME', right_on='State', how='left')
-    del merged_all['State']
-    disorders = {'ANXIETY':'Anxiety', 
-                 'DEPRESS': 'Depression', 
-                 'SCHIZO': 'Schizophrenia',
-                 'TRAUMA': 'Trauma', 
-                 'ADHD':'ADHD'}
-
-    # loop through disorders to create a plot for each one
-    for (disorder, name) in disorders.items():
-        merged_all[disorder + '_PERCENT'] = merged_all[disorder] / merged_all['TOTAL']
-
-        sns.regplot(x='Avg Income 2019', y=disorder, data=merged_all) 
-        plt.xlabel('Average Income')
-        plt.ylabel('Number of ' + name + ' Cases')
-        plt.title('Number of ' + name + ' vs Average Income per State')  
-        plt.savefig('income_' + name +  '_number.png')  
-        plt.clf()
-
-        sns.regplot(x='Avg Income 2019', y=disorder+'_PERCENT', data=merged_all) 
-        plt.xlabel('Average Income')   
-        plt.ylabel('Percentage of ' + name + ' Cases')
-        plt.title('Percentage of ' + name + ' vs Average Income per State') 
-
-        plt.savefig('income_' + name +  '_percent.png') 
-        plt.clf()
+    income = states.to_fips(scrape_income.scrape(store), 'State', 'income')
+    return states.join(merged_geo, income, 'income')
 
 
+@instrument.timed
+def plot_income(merged_all):
+    '''
+    Create plots to show correlation between mental health & income in a state
+    '''
+    jobs = []
+    # a plot of the number and the percent of cases for each disorder
+    for (disorder, name) in DISORDERS.items():
+        jobs.append(FigureJob('income_' + name + '_number.png', _draw_regplot, merged_all,
+                              x='Avg Income 2019', y=disorder, xlabel='Average Income',
+                              ylabel='Number of ' + name + ' Cases',
+                              title='Number of ' + name + ' vs Average Income per State'))
+        jobs.append(FigureJob('income_' + name + '_percent.png', _draw_regplot, merged_all,
+                              x='Avg Income 2019', y=disorder + '_PERCENT', xlabel='Average Income',
+                              ylabel='Percentage of ' + name + ' Cases',
+                              title='Percentage of ' + name + ' vs Average Income per State'))
+    return jobs
+
+
+@instrument.timed
 def plot_age(df, age_merged):
     '''
     For each disorder, plot frequency of disorder v age
     '''
-    disorders = {'ANXIETY':'Anxiety', 
-                 'DEPRESS': 'Depression', 
-                 'SCHIZO': 'Schizophrenia',
-                 'TRAUMA': 'Trauma', 
-                 'ADHD':'ADHD'}
-
-    # loop through each disorder to create a graph for each
-    for (disorder, name) in disorders.items():
-        age_merged[disorder + '_PERCENT'] = age_merged[disorder] / age_merged['TOTAL']
-        plt.figure(figsize=(8, 5))
-
-        sns.barplot(x='Age Range', y=(disorder + '_PERCENT'), data=age_merged)
-        plt.xticks(rotation = 90)
-        plt.ylabel('Percentage of ' + name + ' Cases')
-        plt.title('Percentage of ' + name + ' Cases for Each Age Group')
-        plt.savefig(name + '_age.png')
+    return [FigureJob(name + '_age.png', _draw_age, age_merged, figsize=(8, 5),
+                      disorder=disorder, name=name)
+            for (disorder, name) in DISORDERS.items()]
 
 
+@instrument.timed
 def plot_education(edu_merged):
     '''
     Create plot to see if education has an influence on mental health
     Use # of each disorder
     '''
-    edu_merged = edu_merged.drop(labels=5, axis=0)
-    edu_merged = edu_merged.drop(labels=6, axis=0)
-
-    fig, ax = plt.subplots(1)
-    # stacked plot
-    edu_merged.plot(kind='bar', stacked=True, ax=ax, legend=True)
-    # manually adjust labels
-    labels = ['Sp Edu', '0 to 8', '9 to 11', 'HS Diploma', 'College']
-    ax.set_xticklabels(labels, fontsize=11)
-    plt.xticks(rotation = 0)
-    plt.legend(loc='upper left')
-    plt.ylabel('# of Total Reported Cases')
-    plt.title('Education Level vs Total Reported Cases')
-
-    plt.savefig('education.png')
-    plt.clf()
+    return [FigureJob('education.png', _draw_education, edu_merged)]
 
 
+@instrument.timed
 def plot_education_percentage(edu_merged_percent):
     '''
     Create plot to see if education has an influence on mental health
     Use % of each disorder
     '''
-    edu_merged_percent = edu_merged_percent.drop(labels=5, axis=0)
-    edu_merged_percent = edu_merged_percent.drop(labels=6, axis=0)
-
-    fig, ax = plt.subplots(1)
-    # make stacked plot
-    edu_merged_percent.plot(kind='bar', stacked=True, ax=ax, legend=False)
-    labels = ['0 to 8', '9 to 11', 'HS Diploma', 'College']
-    ax.set_xticklabels(labels, fontsize=11)
-    plt.xticks(rotation = 0)
-
-    del edu_merged_percent['Frequency']
-    del edu_merged_percent['%']
-
-    plt.ylabel('Percent of Total Reported Cases')
-    plt.title('Education Level vs Percent of Total Reported Cases')
-
-    plt.savefig('education_percentages.png')
-    plt.clf()
+    return [FigureJob('education_percentages.png', _draw_education_percentage, edu_merged_percent)]
 
 
+@instrument.timed
 def plot_urban(merged_urb):
     '''
     Create a plot for each disorder
     Plot % urbanization vs mental health cases #s and %s
     '''
-
-    disorders = {'ANXIETY':'Anxiety', 
-                 'DEPRESS': 'Depression', 
-                 'SCHIZO': 'Schizophrenia',
-                 'TRAUMA': 'Trauma', 
-                 'ADHD':'ADHD'}
-
-    sns.regplot(x='UrbanPop', y='TOTAL', data=merged_urb) 
-    plt.xlabel('Percent Urban Population')
-    plt.ylabel('Total # of Reported Cases')
-    plt.title('Urban Population vs # of Total Cases')
-    plt.savefig('urban_vs_total.png')
-    plt.clf()
-
-
-    # loop through disorders to create a plot for each one
-    for (disorder, name) in disorders.items():
-        merged_urb[disorder + '_PERCENT'] = merged_urb[disorder] / merged_urb['TOTAL']
-        sns.regplot(x='UrbanPop', y=disorder, data=merged_urb) 
-        plt.ylabel('Cases of ' + name)
-        plt.xlabel('Percent Urban Population')
-        plt.title('Cases of ' + name + ' vs Percent Urban Population')
-        plt.savefig('urb_' + name +  '_number.png')    
-        plt.clf()
-
-        sns.regplot(x='UrbanPop', y=disorder+'_PERCENT', data=merged_urb) 
-        plt.ylabel('Percent of ' + name)
-        plt.xlabel('Percent Urban Population')
-        plt.title('Percent of ' + name + ' vs Percent Urban Population')
-        plt.savefig('urb_' + name +  '_percent.png')    
-        plt.clf()
-
-    
-
+    jobs = [FigureJob('urban_vs_total.png', _draw_regplot, merged_urb,
+                      x='UrbanPop', y='TOTAL', xlabel='Percent Urban Population',
+                      ylabel='Total # of Reported Cases', title='Urban Population vs # of Total Cases')]
+    for (disorder, name) in DISORDERS.items():
+        jobs.append(FigureJob('urb_' + name + '_number.png', _draw_regplot, merged_urb,
+                              x='UrbanPop', y=disorder, xlabel='Percent Urban Population',
+                              ylabel='Cases of ' + name,
+                              title='Cases of ' + name + ' vs Percent Urban Population'))
+        jobs.append(FigureJob('urb_' + name + '_percent.png', _draw_regplot, merged_urb,
+                              x='UrbanPop', y=disorder + '_PERCENT', xlabel='Percent Urban Population',
+                              ylabel='Percent of ' + name,
+                              title='Percent of ' + name + ' vs Percent Urban Population'))
+    return jobs
+
+
+@instrument.timed
 def plot_crime(crime_merged):
     '''
     Create a plot for each disorder
     Plot average crime rates vs each disorder
     '''
-    disorders = {'ANXIETY':'Anxiety', 
-                 'DEPRESS': 'Depression', 
-                 'SCHIZO': 'Schizophrenia',
-                 'TRAUMA': 'Trauma', 
-                 'ADHD':'ADHD'}
-                 
-    # loop through each disorder and make a plot
-    for (disorder, name) in disorders.items():
-        crime_merged[disorder + '_PERCENT'] = crime_merged[disorder] / crime_merged['TOTAL']
-
-        sns.regplot(x='Crime Rate', y=disorder, data=crime_merged) 
-        plt.ylabel('Cases of ' + name)
-        plt.xlabel('Crime Rate')
-        plt.title('Total Cases of ' + name + ' vs Crime Rate')
-        plt.savefig('crime_' + name +  '_number.png')  
-        plt.clf()
-
-        sns.regplot(x='Crime Rate', y=disorder+'_PERCENT', data=crime_merged) 
-        plt.savefig('crime_' + name +  '_percent.png')    
-        plt.ylabel('Percent of ' + name)
-        plt.xlabel('Crime Rate')
-        plt.title('Percent of ' + name + ' vs Crime Rate')
-        plt.clf()
-
-
-def main():
-    data = DataPrep(pd.read_csv('mhcld-puf-2019-csv.csv'))
-
-    # main mental health dataset
-    df = data.clean_df()
-    
+    jobs = []
+    for (disorder, name) in DISORDERS.items():
+        jobs.append(FigureJob('crime_' + name + '_number.png', _draw_regplot, crime_merged,
+                              x='Crime Rate', y=disorder, xlabel='Crime Rate',
+                              ylabel='Cases of ' + name,
+                              title='Total Cases of ' + name + ' vs Crime Rate'))
+        jobs.append(FigureJob('crime_' + name + '_percent.png', _draw_regplot, crime_merged,
+                              x='Crime Rate', y=disorder + '_PERCENT', xlabel='Crime Rate',
+                              ylabel='Percent of ' + name,
+                              title='Percent of ' + name + ' vs Crime Rate'))
+    return jobs
+
+
+def main(paths=(load_data.DATA_FILE,), chunk_size=None, workers=None, plot_workers=None,
+         force=False, dry_run=False, offline=False, report=instrument.REPORT_FILE):
+    instrument.reset()
+    store = providers.STORE
+    if offline or dry_run:
+        # weather and income come from the saved snapshots only, a dry run never
+        # goes online; a store of the run's own leaves the shared one as it was
+        store = providers.SnapshotStore(offline=True)
+    if workers:
+        # parallel mode: byte ranges of the csvs are aggregated on a process pool
+        data = DataPrep(None, aggregate.aggregate_parallel(paths, workers))
+        df = None
+    elif chunk_size:
+        # streaming mode: only the aggregates are kept, never the full dataset
+        data = DataPrep(None, aggregate.aggregate_files(paths, chunk_size))
+        df = None
+    else:
+        # main mental health dataset, already cleaned in the columnar cache,
+        # the csv is only parsed (and cleaned) again when it changes
+        df = pd.concat([data_cache.load_clean(path, columns=REPORT_COLUMNS) for path in paths],
+                       ignore_index=True)
+        data = DataPrep(df)
+
     # merge main data with shp file
     geodata_merged = data.join_data_geo(data.groupby_state(df))
 
+    # each plot_ function returns its figures as jobs, which are all rendered at the end
+    jobs = []
+
     # get data for and plot demographic factors 
-    age_merged = data.age_data(df)
-    plot_age(df, age_merged)
+    # every plot reads its percents from the metrics layer
+    age_merged = metrics.rates(data.age_data(df))
+    jobs += plot_age(df, age_merged)
     employment_data = data.employment_data(df)
-    plot_employment(employment_data)
+    jobs += plot_employment(employment_data)
 
     education_data = data.groupby_education(df)
-    plot_education(education_data)
+    jobs += plot_education(education_data)
 
     education_data_percent = data.education_percentage(df)
-    plot_education_percentage(education_data_percent)
+    jobs += plot_education_percentage(education_data_percent)
+
+    pages = [scrape_weather.PROVIDER, scrape_income.PROVIDER]
+    if dry_run:
+        # a dry run compares against the saved snapshots
+        missing = [page.name for page in pages if not store.snapshots(page)]
+    else:
+        # fetch the out of date enrichment pages all at once, before they're needed
+        store.refresh(pages)
+        missing = []
+
+    # the state figures only read the case counts and rates, so a change
+    # to an enrichment page only makes the figures that use it stale
+    state_rates = metrics.rates(geodata_merged)
 
     # get data for and plot geographic data
-    plot_geospatial(geodata_merged)
-    plot_weather(geodata_merged)
+    jobs += plot_geospatial(state_rates)
+    if 'weather' not in missing:
+        merged_geo_weather = weather_data(geodata_merged, store)
+        jobs += plot_weather(merged_geo_weather)
 
     # get data for and plot economic factors
-    plot_income(geodata_merged)
+    if 'income' not in missing:
+        jobs += plot_income(income_data(state_rates, store))
 
-    urb_data = data.load_urb_data(geodata_merged)
-    plot_urban(urb_data)
+    urb_data = data.load_urb_data(state_rates)
+    jobs += plot_urban(urb_data)
 
     crime = data.crime_data(urb_data)
-    plot_crime(crime)
+    jobs += plot_crime(crime)
+
+    if dry_run:
+        # list what a build would redraw, without drawing it
+        outdated = jobs if force else render.stale(jobs)
+        for job in outdated:
+            print('stale:', job.filename)
+        for name in missing:
+            print('stale: every figure from the', name, 'page, which has never been fetched')
+        print(len(outdated), 'of', len(jobs), 'figures would be rendered')
+        return
+
+    # cases by year, useful when several years of files are combined
+    data.aggregates(df).table('YEAR').to_csv('year.csv')
+    # the weather page also has each state's population, the denominator of the per 100k rates
+    metrics.rates(merged_geo_weather, population='Population').drop(columns='geometry').to_csv(
+        STATE_RATES_FILE, index=False)
+
+    saved = render.render(jobs, plot_workers, force)
+    print('Rendered', len(saved), 'of', len(jobs), 'figures,', len(jobs) - len(saved), 'up to date')
+    print(scrape_cache.SCRAPE_CACHE.summary())
+
+    # where the time went
+    print(instrument.summary())
+    print('Run report saved to', instrument.report(report, data=list(paths)))
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    # the options live in cli.py, python main.py is the same as python cli.py report
+    import cli
+
+    cli.main(['report'] + sys.argv[1:])
@@ -0,0 +1,70 @@
+import numpy as np
+from scipy import stats
+
+# disorder column of the aggregate tables -> name in the figures, in plotting order
+DISORDERS = {'ANXIETY': 'Anxiety',
+             'DEPRESS': 'Depression',
+             'SCHIZO': 'Schizophrenia',
+             'TRAUMA': 'Trauma',
+             'ADHD': 'ADHD'}
+CONFIDENCE = 0.95
+METHODS = ['wilson', 'clopper-pearson']
+PER = 100000
+
+
+def wilson(cases, total, confidence=CONFIDENCE):
+    '''
+    (low, high) Wilson score interval for the share cases / total,
+    for whole arrays at once
+    '''
+    z = stats.norm.ppf(0.5 + confidence / 2)
+    share = cases / total
+    center = (share + z ** 2 / (2 * total)) / (1 + z ** 2 / total)
+    half = z / (1 + z ** 2 / total) * np.sqrt(share * (1 - share) / total + z ** 2 / (4 * total ** 2))
+    return (center - half, center + half)
+
+
+def clopper_pearson(cases, total, confidence=CONFIDENCE):
+    '''
+    (low, high) exact Clopper-Pearson interval for the share cases / total,
+    from the beta distribution, for whole arrays at once
+    '''
+    alpha = 1 - confidence
+    low = np.where(cases > 0, stats.beta.ppf(alpha / 2, cases, total - cases + 1), 0.0)
+    high = np.where(cases < total, stats.beta.ppf(1 - alpha / 2, cases + 1, total - cases), 1.0)
+    # a missing count stays missing
+    missing = np.isnan(cases) | np.isnan(total)
+    return (np.where(missing, np.nan, low), np.where(missing, np.nan, high))
+
+
+def rates(table, disorders=DISORDERS, total='TOTAL', population=None,
+          confidence=CONFIDENCE, method='wilson'):
+    '''
+    a new table with the derived metrics of every disorder added:
+    <DISORDER>_PERCENT, the share of the cases (total) with the disorder,
+    <DISORDER>_LOW and <DISORDER>_HIGH, its confidence interval, and
+    <DISORDER>_PER_100K, cases per 100,000 people when a population column is given
+    every disorder is computed at once on a (rows x disorders) array,
+    and the table passed in is never changed
+    method is one of METHODS
+    '''
+    if method not in METHODS:
+        raise ValueError('unknown interval method ' + repr(method) + ', expected one of ' + str(METHODS))
+    disorders = list(disorders)
+    cases = table[disorders].to_numpy(dtype=float)
+    totals = table[total].to_numpy(dtype=float)[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        share = cases / totals
+        if method == 'wilson':
+            low, high = wilson(cases, totals, confidence)
+        else:
+            low, high = clopper_pearson(cases, totals, confidence)
+
+    metrics = {}
+    for (suffix, values) in [('_PERCENT', share), ('_LOW', low), ('_HIGH', high)]:
+        metrics.update({disorder + suffix: values[:, i] for (i, disorder) in enumerate(disorders)})
+    if population is not None:
+        per_person = cases / table[population].to_numpy(dtype=float)[:, None]
+        metrics.update({disorder + '_PER_100K': per_person[:, i] * PER
+                        for (i, disorder) in enumerate(disorders)})
+    return table.assign(**metrics)
@@ -1,5 +1,5 @@
 import pandas as pd
-from tabula import read_pdf
+import codebook
 
 def test_groupby(df):
   '''
@@ -12,9 +12,9 @@ def test_groupby(df):
 
 def test_scrape(df):
   '''
-  scrape a pdf file
+  look up the age table the pdf had in the compiled codebook
   '''
-  age_doc = read_pdf('Age Doc.pdf', pages = '1')[0]
+  age_doc = codebook.table('AGE')
   age_doc = age_doc[['Label', 'Value']]
 
   return age_doc.dropna()
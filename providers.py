@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import hashlib
+import asyncio
+import instrument
+
+SNAPSHOT_DIR = os.path.join('.cache', 'snapshots')
+# a snapshot younger than this is used without going online
+TTL = 30 * 24 * 60 * 60
+TIMEOUT = 10
+RETRIES = 3
+# sources fetched at the same time
+CONCURRENCY = 4
+# snapshots kept per source
+VERSIONS = 5
+
+
+class Provider:
+    '''
+    One web source of enrichment data: where to get the page and
+    how to turn it into a table. parse(html) returns a DataFrame.
+    '''
+    def __init__(self, name, url, parse, ttl=TTL, timeout=TIMEOUT):
+        self.name = name
+        self.url = url
+        self.parse = parse
+        self.ttl = ttl
+        self.timeout = timeout
+
+
+# one pool of keep-alive connections for every fetch, big enough for CONCURRENCY threads
+# made on the first fetch, so runs that only use snapshots never import requests
+_session = None
+
+
+def _get(url, timeout):
+    global _session
+    if _session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        _session = requests.Session()
+        _session.mount('http://', HTTPAdapter(pool_maxsize=CONCURRENCY))
+        _session.mount('https://', HTTPAdapter(pool_maxsize=CONCURRENCY))
+    page = _session.get(url, timeout=timeout)
+    page.raise_for_status()
+    return page.content
+
+
+def fetch(url, timeout=TIMEOUT, retries=RETRIES):
+    '''
+    gets a page, with a timeout on every attempt and a growing wait between them
+    '''
+    for attempt in range(retries):
+        try:
+            return _get(url, timeout)
+        # every requests error is an OSError
+        except OSError:
+            if attempt == retries - 1:
+                raise
+            time.sleep(2 ** attempt)
+
+
+async def fetch_async(url, timeout=TIMEOUT, retries=RETRIES):
+    '''
+    fetch for the event loop: the blocking get runs on a thread,
+    and the wait between attempts doesn't hold up other fetches
+    '''
+    for attempt in range(retries):
+        try:
+            return await asyncio.to_thread(_get, url, timeout)
+        except OSError:
+            if attempt == retries - 1:
+                raise
+            await asyncio.sleep(2 ** attempt)
+
+
+class SnapshotStore:
+    '''
+    Versioned copies of the pages the providers fetch.
+    A page is fetched again only when its newest snapshot is older than
+    the provider's ttl. Offline, the newest snapshot is used however old
+    it is and nothing is fetched; offline is also turned on by setting
+    the MH_OFFLINE environment variable.
+    '''
+    def __init__(self, snapshot_dir=SNAPSHOT_DIR, offline=None, versions=VERSIONS, retries=RETRIES):
+        self._snapshot_dir = snapshot_dir
+        self._retries = retries
+        if offline is None:
+            offline = bool(os.environ.get('MH_OFFLINE'))
+        self.offline = offline
+        self._versions = versions
+        # parsed tables by snapshot file, so a page is only parsed once per process
+        self._tables = {}
+        self.fetches = 0
+
+
+    def _index_file(self, provider):
+        return os.path.join(self._snapshot_dir, provider.name + '.json')
+
+
+    def snapshots(self, provider):
+        '''
+        the snapshots of a provider, newest first
+        each has the file, the url and the time it was fetched
+        '''
+        index_file = self._index_file(provider)
+        if not os.path.exists(index_file):
+            return []
+        with open(index_file) as f:
+            return json.load(f)
+
+
+    def save(self, provider, html):
+        '''
+        stores a fetched page as the newest snapshot, dropping the oldest ones
+        '''
+        os.makedirs(self._snapshot_dir, exist_ok=True)
+        fetched = time.time()
+        digest = hashlib.sha256(html).hexdigest()[:12]
+        filename = provider.name + '-' + time.strftime('%Y%m%dT%H%M%S', time.gmtime(fetched)) + '-' + digest + '.html'
+        with open(os.path.join(self._snapshot_dir, filename), 'wb') as f:
+            f.write(html)
+
+        snapshots = [{'file': filename, 'url': provider.url, 'fetched': fetched}] + self.snapshots(provider)
+        for old in snapshots[self._versions:]:
+            old_file = os.path.join(self._snapshot_dir, old['file'])
+            if os.path.exists(old_file) and old['file'] != filename:
+                os.remove(old_file)
+        with open(self._index_file(provider), 'w') as f:
+            json.dump(snapshots[:self._versions], f, indent=1)
+        return snapshots[0]
+
+
+    def _current(self, provider):
+        '''
+        the newest snapshot if it can be used without fetching, otherwise None
+        '''
+        snapshots = self.snapshots(provider)
+        newest = snapshots[0] if snapshots else None
+        if self.offline:
+            if newest is None:
+                raise FileNotFoundError('offline and there is no snapshot of ' + provider.name
+                                        + ' in ' + self._snapshot_dir)
+            return newest
+        if newest is not None and time.time() - newest['fetched'] < provider.ttl:
+            return newest
+        return None
+
+
+    def _fallback(self, provider, error):
+        '''
+        if a fetch fails, an out of date snapshot is still better than none
+        '''
+        snapshots = self.snapshots(provider)
+        if not snapshots:
+            raise error
+        print(provider.name + ': fetch failed (' + str(error) + '), using the snapshot from',
+              time.strftime('%Y-%m-%d', time.gmtime(snapshots[0]['fetched'])))
+        return snapshots[0]
+
+
+    def latest(self, provider):
+        '''
+        the newest snapshot, fetching a new one first if it's out of date
+        '''
+        snapshot = self._current(provider)
+        if snapshot is not None:
+            return snapshot
+        try:
+            html = fetch(provider.url, provider.timeout, self._retries)
+        except OSError as error:
+            return self._fallback(provider, error)
+        self.fetches += 1
+        return self.save(provider, html)
+
+
+    def _parse(self, provider, snapshot):
+        snapshot_file = os.path.join(self._snapshot_dir, snapshot['file'])
+        if snapshot_file not in self._tables:
+            with open(snapshot_file, 'rb') as f:
+                self._tables[snapshot_file] = provider.parse(f.read())
+        return self._tables[snapshot_file]
+
+
+    def table(self, provider):
+        '''
+        the provider's table, parsed from its newest snapshot
+        '''
+        return self._parse(provider, self.latest(provider)).copy()
+
+
+    async def _update(self, provider, semaphore):
+        snapshot = self._current(provider)
+        if snapshot is None:
+            try:
+                async with semaphore:
+                    html = await fetch_async(provider.url, provider.timeout, self._retries)
+                self.fetches += 1
+                snapshot = self.save(provider, html)
+            except OSError as error:
+                snapshot = self._fallback(provider, error)
+        # parsing runs on a thread too, so a big page doesn't hold up the other fetches
+        return await asyncio.to_thread(self._parse, provider, snapshot)
+
+
+    async def _refresh(self, providers, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+        # one failing source doesn't cancel the others, its error is raised once they're done
+        tables = await asyncio.gather(*[self._update(provider, semaphore) for provider in providers],
+                                      return_exceptions=True)
+        for table in tables:
+            if isinstance(table, Exception):
+                raise table
+        return {provider.name: table.copy() for (provider, table) in zip(providers, tables)}
+
+
+    @instrument.timed
+    def refresh(self, providers, concurrency=CONCURRENCY):
+        '''
+        brings the snapshots of all the providers up to date at the same
+        time, at most concurrency fetches at once, and parses them
+        takes about as long as the slowest source instead of all of them
+        returns name -> table, later table() calls use the parsed tables
+        '''
+        return asyncio.run(self._refresh(list(providers), concurrency))
+
+
+# shared by every caller in the process
+STORE = SnapshotStore()
@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import instrument
+
+# fingerprint of every figure from the last build
+MANIFEST = os.path.join('.cache', 'figures.json')
+
+# data for the jobs, set once in each worker process
+_tables = {}
+
+
+class FigureJob:
+    '''
+    One png of the report.
+    draw(fig, data, **kwargs) has to be a module level function (so it
+    can be sent to a worker) that only draws on the Figure it is given,
+    never through pyplot.
+    '''
+    def __init__(self, filename, draw, data, figsize=None, **kwargs):
+        self.filename = filename
+        self.draw = draw
+        self.data = data
+        self.figsize = figsize
+        self.kwargs = kwargs
+
+
+def _init_worker(tables):
+    global _tables
+    _tables = tables
+
+
+def _render(task):
+    '''
+    draws and saves one figure, with the Agg canvas and no pyplot state
+    returns the filename with the wall and cpu time it took
+    '''
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    (filename, draw, key, figsize, kwargs) = task
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    draw(fig, _tables[key], **kwargs)
+    fig.savefig(filename)
+    # pyplot never saw the figure, so once it's cleared nothing keeps it alive
+    fig.clear()
+    return (filename, time.perf_counter() - wall, time.process_time() - cpu)
+
+
+def _table_hash(data):
+    '''
+    hash of a table's columns, index and values
+    '''
+    # geometries are hashed through their wkb bytes
+    if hasattr(data, 'to_wkb'):
+        data = data.to_wkb()
+    digest = hashlib.sha256(repr(list(data.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(data).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def fingerprints(jobs):
+    '''
+    filename -> fingerprint of everything that goes into the figure:
+    its data table, the code of its draw function, its size and parameters
+    '''
+    tables = {}
+    result = {}
+    for job in jobs:
+        key = id(job.data)
+        if key not in tables:
+            tables[key] = _table_hash(job.data)
+        code = job.draw.__code__
+        digest = hashlib.sha256(tables[key].encode())
+        digest.update(code.co_code)
+        digest.update(repr((job.draw.__module__, job.draw.__qualname__, code.co_consts,
+                            job.figsize, sorted(job.kwargs.items()))).encode())
+        result[job.filename] = digest.hexdigest()
+    return result
+
+
+def _read_manifest(manifest):
+    if not os.path.exists(manifest):
+        return {}
+    with open(manifest) as f:
+        return json.load(f)
+
+
+def stale(jobs, manifest=MANIFEST):
+    '''
+    the jobs whose figure is missing or was drawn from different inputs
+    '''
+    built = _read_manifest(manifest)
+    current = fingerprints(jobs)
+    return [job for job in jobs
+            if built.get(job.filename) != current[job.filename] or not os.path.exists(job.filename)]
+
+
+@instrument.timed
+def render(jobs, workers=None, force=False, manifest=MANIFEST):
+    '''
+    renders the jobs, on a process pool unless workers is 1
+    figures whose inputs haven't changed since the last build are skipped
+    unless force is set
+    each distinct data table is sent to a worker once, not once per figure
+    returns the saved filenames
+    '''
+    current = fingerprints(jobs)
+    if not force:
+        jobs = stale(jobs, manifest)
+
+    tables = {}
+    tasks = []
+    for job in jobs:
+        key = id(job.data)
+        tables[key] = job.data
+        tasks.append((job.filename, job.draw, key, job.figsize, job.kwargs))
+    if not tasks:
+        return []
+
+    if workers is None:
+        workers = min(os.cpu_count(), len(tasks))
+    if workers <= 1:
+        _init_worker(tables)
+        rendered = [_render(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(tables,)) as pool:
+            rendered = list(pool.map(_render, tasks))
+    # figures drawn in a worker are timed there
+    for (filename, wall, cpu) in rendered:
+        instrument.add('figure ' + os.path.basename(filename), wall, cpu)
+    saved = [filename for (filename, _, _) in rendered]
+
+    # only record figures that were actually saved
+    built = _read_manifest(manifest)
+    built.update({filename: current[filename] for filename in saved})
+    os.makedirs(os.path.dirname(manifest) or '.', exist_ok=True)
+    with open(manifest, 'w') as f:
+        json.dump(built, f, indent=1, sort_keys=True)
+    return saved
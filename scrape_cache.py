@@ -0,0 +1,84 @@
+import os
+import pickle
+from collections import OrderedDict
+import load_data
+
+CACHE_DIR = os.path.join('.cache', 'scrape')
+MAX_TABLES = 32
+MAX_BYTES = 50 * 1024 * 1024
+
+
+class ScrapeCache:
+    '''
+    Two level cache for tables scraped out of pdfs.
+    An in-process LRU sits in front of a directory of pickled tables,
+    both keyed by (path, pages, hash of the pdf), so an edited pdf is
+    scraped again. The directory is trimmed back to max_bytes by
+    removing the least recently used tables.
+    '''
+    def __init__(self, cache_dir=CACHE_DIR, max_tables=MAX_TABLES, max_bytes=MAX_BYTES):
+        self._cache_dir = cache_dir
+        self._max_tables = max_tables
+        self._max_bytes = max_bytes
+        self._tables = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+
+    def get(self, pdf, pages, scrape):
+        '''
+        returns the cached table, or calls scrape(pdf, pages) and caches it
+        '''
+        digest = load_data.file_hash(pdf)
+        key = (os.path.abspath(pdf), str(pages), digest)
+        if key in self._tables:
+            self.hits += 1
+            self._tables.move_to_end(key)
+            return self._tables[key].copy()
+
+        disk_file = os.path.join(self._cache_dir, digest[:32] + '-' + str(pages).replace(',', '_') + '.pkl')
+        if os.path.exists(disk_file):
+            self.disk_hits += 1
+            # mark it as recently used for eviction
+            os.utime(disk_file)
+            with open(disk_file, 'rb') as f:
+                table = pickle.load(f)
+        else:
+            self.misses += 1
+            table = scrape(pdf, pages)
+            os.makedirs(self._cache_dir, exist_ok=True)
+            with open(disk_file, 'wb') as f:
+                pickle.dump(table, f)
+            self._evict_disk()
+
+        self._tables[key] = table
+        if len(self._tables) > self._max_tables:
+            self._tables.popitem(last=False)
+        return table.copy()
+
+
+    def _evict_disk(self):
+        '''
+        removes the least recently used files until the directory fits in max_bytes
+        '''
+        files = [os.path.join(self._cache_dir, name) for name in os.listdir(self._cache_dir)]
+        files.sort(key=os.path.getmtime)
+        size = sum(os.path.getsize(f) for f in files)
+        while files and size > self._max_bytes:
+            oldest = files.pop(0)
+            size -= os.path.getsize(oldest)
+            os.remove(oldest)
+
+
+    def clear(self):
+        self._tables.clear()
+
+
+    def summary(self):
+        return ('pdf scrape cache: ' + str(self.hits) + ' memory hits, ' + str(self.disk_hits)
+                + ' disk hits, ' + str(self.misses) + ' misses (tabula runs)')
+
+
+# shared by every caller in the process
+SCRAPE_CACHE = ScrapeCache()
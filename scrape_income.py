@@ -1,24 +1,31 @@
-import requests
 import pandas as pd
-from bs4 import BeautifulSoup
+import html_table
+import providers
+import instrument
 
-def scrape():
-    url = 'https://en.wikipedia.org/wiki/List_of_U.S._states_and_territories_by_income'
-    page = requests.get(url)
+URL = 'https://en.wikipedia.org/wiki/List_of_U.S._states_and_territories_by_income'
 
-    # create a beautiful soup object that can parse the HTML content
-    soup = BeautifulSoup(page.content, 'html.parser')
 
-    # get the table markup from soup object
-    table = soup.select('#mw-content-text > div.mw-parser-output > table:nth-child(12)')
-    cols = [ col.get_text() for col in table[0].select('tbody > tr > td') ]
+def parse(html):
+    '''
+    2019 average income of each state, from the wikipedia list
+    '''
+    # the table with a column for 2019, found by its header rather than its place in the page
+    table = html_table.read_table(html, '2019')
 
-    # create a list for each column, getting the text content as needed
-    state = pd.Series([ cols[e+1] for e in range(0, len(cols)) if e % 13 == 0]).apply(lambda s: s[:(len(s)-1)])
-                                                                                                                                                                                                        
-    income_2019 = pd.Series([ cols[e+2] for e in range(0, len(cols)) if e % 13 == 0]).apply(lambda s: int((s[1:(len(s)-1)]).replace(',','')))
+    # cells look like 'Alabama' and '$56,200'
+    d = {'State': table.iloc[:, 1], 'Avg Income 2019': html_table.numbers(table['2019'])}
+    income = pd.DataFrame(d)
+    return income
 
 
-    d = {'State': list(state),'Avg Income 2019': income_2019}    
-    income = pd.DataFrame(d)
-    return income
\ No newline at end of file
+PROVIDER = providers.Provider('income', URL, parse)
+
+
+@instrument.timed
+def scrape(store=None):
+    '''
+    the income table, from a snapshot of the page that is only
+    fetched again once it's out of date
+    '''
+    return (store or providers.STORE).table(PROVIDER)
@@ -1,28 +1,34 @@
-import requests
 import pandas as pd
-from bs4 import BeautifulSoup
+import html_table
+import providers
+import instrument
 
-def scrape():
+URL = 'http://www.usa.com/rank/us--average-temperature--state-rank.htm'
 
-    url = 'http://www.usa.com/rank/us--average-temperature--state-rank.htm'
-    page = requests.get(url)
 
-    # create a beautiful soup object that can parse the HTML content
-    soup = BeautifulSoup(page.content, 'html.parser')
+def parse(html):
+    '''
+    average temperature and population of each state, from the usa.com ranking page
+    '''
+    # the ranking table, found by its header rather than its place in the page
+    table = html_table.read_table(html, 'Average Temperature')
 
-    # get the table markup from soup object
-    table = soup.select('#hcontent > table')
-    cols = [ col.get_text() for col in table[0].select('tr > td') ]
+    # cells look like '71.90°F' and 'Idaho / 1,754,367'
+    state = table.iloc[:, 2].str.split('/')
+    d = {'Avg Temp': html_table.numbers(table.iloc[:, 1]),
+         'State Name': state.str[0].str.strip(),
+         'Population': html_table.numbers(state.str[1])}
+    weather = pd.DataFrame(d)
+    return weather
 
-    # create a list for each column, getting the text content as needed
-    col1 = [ cols[e] for e in range(1, len(cols)) if e % 3 == 0]
-    col2 = [ cols[(3 * e) + 1] for e in range(1, 52) ]
-    col3 = [ cols[(3 * e) + 2] for e in range(1, 52) ]
-    state_name = [ col.get_text() for col in table[0].select('tr > td > a') ]
 
-    ser = pd.Series(col2)
-    ser = ser.apply(lambda s: float(s[0:5]))
+PROVIDER = providers.Provider('weather', URL, parse)
 
-    d = {'Avg Temp': list(ser),'State Name': state_name}    
-    weather = pd.DataFrame(d)
-    return weather
\ No newline at end of file
+
+@instrument.timed
+def scrape(store=None):
+    '''
+    the weather table, from a snapshot of the page that is only
+    fetched again once it's out of date
+    '''
+    return (store or providers.STORE).table(PROVIDER)
@@ -0,0 +1,77 @@
+import pandas as pd
+
+# FIPS code, postal abbreviation and name of every state the data covers
+STATES = [(1, 'AL', 'Alabama'), (2, 'AK', 'Alaska'), (4, 'AZ', 'Arizona'), (5, 'AR', 'Arkansas'),
+          (6, 'CA', 'California'), (8, 'CO', 'Colorado'), (9, 'CT', 'Connecticut'),
+          (10, 'DE', 'Delaware'), (11, 'DC', 'District of Columbia'), (12, 'FL', 'Florida'),
+          (13, 'GA', 'Georgia'), (15, 'HI', 'Hawaii'), (16, 'ID', 'Idaho'), (17, 'IL', 'Illinois'),
+          (18, 'IN', 'Indiana'), (19, 'IA', 'Iowa'), (20, 'KS', 'Kansas'), (21, 'KY', 'Kentucky'),
+          (22, 'LA', 'Louisiana'), (23, 'ME', 'Maine'), (24, 'MD', 'Maryland'),
+          (25, 'MA', 'Massachusetts'), (26, 'MI', 'Michigan'), (27, 'MN', 'Minnesota'),
+          (28, 'MS', 'Mississippi'), (29, 'MO', 'Missouri'), (30, 'MT', 'Montana'),
+          (31, 'NE', 'Nebraska'), (32, 'NV', 'Nevada'), (33, 'NH', 'New Hampshire'),
+          (34, 'NJ', 'New Jersey'), (35, 'NM', 'New Mexico'), (36, 'NY', 'New York'),
+          (37, 'NC', 'North Carolina'), (38, 'ND', 'North Dakota'), (39, 'OH', 'Ohio'),
+          (40, 'OK', 'Oklahoma'), (41, 'OR', 'Oregon'), (42, 'PA', 'Pennsylvania'),
+          (44, 'RI', 'Rhode Island'), (45, 'SC', 'South Carolina'), (46, 'SD', 'South Dakota'),
+          (47, 'TN', 'Tennessee'), (48, 'TX', 'Texas'), (49, 'UT', 'Utah'), (50, 'VT', 'Vermont'),
+          (51, 'VA', 'Virginia'), (53, 'WA', 'Washington'), (54, 'WV', 'West Virginia'),
+          (55, 'WI', 'Wisconsin'), (56, 'WY', 'Wyoming'), (72, 'PR', 'Puerto Rico')]
+
+# other spellings the sources use
+ALIASES = {'washington dc': 11, 'washington d.c.': 11, 'd.c.': 11}
+
+
+def states():
+    '''
+    the state dimension table, indexed by STATEFIP with NAME and ABBREV columns
+    '''
+    table = pd.DataFrame(STATES, columns=['STATEFIP', 'ABBREV', 'NAME'])
+    return table.set_index('STATEFIP')[['NAME', 'ABBREV']]
+
+
+def _keys():
+    '''
+    lower case name or abbreviation -> STATEFIP
+    '''
+    keys = dict(ALIASES)
+    for (fips, abbrev, name) in STATES:
+        keys[name.lower()] = fips
+        keys[abbrev.lower()] = fips
+    return keys
+
+
+def to_fips(df, column, source):
+    '''
+    re-keys a table from state names or abbreviations to a STATEFIP index
+    names are matched without case and surrounding whitespace
+    rows with no known state, or a second row for the same state, are
+    dropped and reported instead of silently missing from joins
+    '''
+    names = df[column].astype(str).str.replace('\xa0', ' ').str.strip().str.lower()
+    fips = names.map(_keys())
+
+    unknown = fips.isna()
+    if unknown.any():
+        print(source + ': dropped', unknown.sum(), 'rows with unknown states:',
+              ', '.join(df.loc[unknown, column].astype(str)))
+    keyed = df[~unknown].drop(columns=column)
+    keyed.index = pd.Index(fips[~unknown].astype(int), name='STATEFIP')
+
+    repeated = keyed.index.duplicated()
+    if repeated.any():
+        print(source + ': dropped', repeated.sum(), 'repeated rows for',
+              ', '.join(states().loc[keyed.index[repeated], 'NAME']))
+        keyed = keyed[~repeated]
+    return keyed
+
+
+def join(left, right, source):
+    '''
+    adds the columns of a STATEFIP indexed table to a table with a STATEFIP column
+    reports the states in left that the source has no row for
+    '''
+    missing = ~left['STATEFIP'].isin(right.index)
+    if missing.any():
+        print(source + ': no data for', ', '.join(states().loc[left.loc[missing, 'STATEFIP'], 'NAME']))
+    return left.join(right, on='STATEFIP')
@@ -1,10 +1,709 @@
 import our_code_tests
-import tabula
 import pandas as pd
+import numpy as np
 from cse163_utils import assert_equals
+import os
+import json
+import tempfile
+import load_data
+import data_cache
+import aggregate
+from aggregate import DisorderAggregates
+from cube import CountCube, load_cube
+from data_prep import DataPrep
+import codebook
+from scrape_cache import ScrapeCache
+import machine_learning
+from features import FeatureEncoder
+import render
+import geometry
+import states
+import threading
+import time
+import functools
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+import providers
+import requests
+import scrape_income
+import scrape_weather
+import html_table
+import benchmark
+import instrument
+import cli
+import subprocess
+import sys
+import shapely
+import comorbidity
+import metrics
+import main as report
 
+TEST_FILE = 'Testing File Mental Health.csv'
 
-def main():
+
+def test_load_data():
+    '''
+    the loader should only parse the requested columns, with compact dtypes
+    '''
+    df = load_data.load(TEST_FILE, columns=['AGE', 'STATEFIP', 'CASEID'])
+    assert_equals(['AGE', 'STATEFIP', 'CASEID'], list(df.columns))
+    assert_equals(19, len(df))
+
+    df = load_data.downcast(df.dropna())
+    assert_equals(['int8', 'int8', 'int64'], [str(t) for t in df.dtypes])
+
+    # chunks should add back up to the full file
+    chunks = list(load_data.load_chunks(TEST_FILE, columns=['AGE'], chunk_size=5))
+    assert_equals([5, 5, 5, 4], [len(chunk) for chunk in chunks])
+    assert_equals(list(df['AGE']), list(pd.concat(chunks)['AGE']))
+
+    # blank fields fall back to nullable columns, so clean_df can drop those rows
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'blank.csv')
+        with open(path, 'w') as f:
+            f.write('AGE,STATEFIP\n3,1\n,2\n5,6\n')
+        assert_equals(['Int8', 'Int8'], [str(t) for t in load_data.load(path).dtypes])
+        assert_equals([3, 5], list(DataPrep(load_data.load(path)).clean_df()['AGE']))
+        chunks = list(load_data.load_chunks(path, chunk_size=2))
+        assert_equals(['Int8', 'int8'], [str(chunk['AGE'].dtype) for chunk in chunks])
+
+
+def test_data_cache():
+    '''
+    the feather cache should hold exactly what clean_df produces,
+    and only be rebuilt when the csv changes
+    '''
+    expected = DataPrep(load_data.load(TEST_FILE)).clean_df()
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cached = data_cache.load_clean(TEST_FILE, cache_dir=cache_dir)
+        assert_equals(True, expected.reset_index(drop=True).equals(cached))
+
+        cache_file = data_cache.cached(TEST_FILE, cache_dir)
+        assert_equals(cache_dir, os.path.dirname(cache_file))
+        built = os.stat(cache_file).st_mtime_ns
+        subset = data_cache.load_clean(TEST_FILE, columns=['AGE', 'DIAGNOSIS 1'], cache_dir=cache_dir)
+        assert_equals(['AGE', 'DIAGNOSIS 1'], list(subset.columns))
+        assert_equals(built, os.stat(cache_file).st_mtime_ns)
+
+        # a csv with only a header
+        empty_file = os.path.join(cache_dir, 'empty.csv')
+        with open(empty_file, 'w') as f:
+            f.write(','.join(load_data.header(TEST_FILE)) + '\n')
+        empty = data_cache.load_clean(empty_file, cache_dir=cache_dir)
+        assert_equals(0, len(empty))
+        assert_equals(list(expected.columns), list(empty.columns))
+
+        # a csv with the same name in another folder gets its own cache
+        os.makedirs(os.path.join(cache_dir, 'other'))
+        other_file = os.path.join(cache_dir, 'other', 'empty.csv')
+        with open(other_file, 'w') as f:
+            f.write(','.join(load_data.header(TEST_FILE)) + '\n')
+        assert_equals(False, data_cache.cached(other_file, cache_dir) == data_cache.cached(empty_file, cache_dir))
+
+
+def test_aggregates():
+    '''
+    the single pass aggregates should match a plain groupby for every dimension
+    '''
+    df = DataPrep(load_data.load(TEST_FILE)).clean_df()
+    aggregates = DisorderAggregates.from_frame(df)
+    for dim in ['AGE', 'STATEFIP', 'MARSTAT', 'EMPLOY', 'EDUC', 'RACE', 'REGION', 'GENDER']:
+        expected = our_code_tests.test_groupby(df.assign(AGE=df[dim]))
+        assert_equals(expected.values.tolist(), aggregates.table(dim).values.tolist())
+        assert_equals(list(expected.index), list(aggregates.table(dim).index))
+
+    # streaming in chunks, over two copies of the file, should give exactly double
+    streamed = aggregate.aggregate_files([TEST_FILE, TEST_FILE], chunk_size=4)
+    for dim in ['AGE', 'STATEFIP', 'EDUC', 'YEAR']:
+        assert_equals((aggregates.table(dim) * 2).values.tolist(), streamed.table(dim).values.tolist())
+    assert_equals([2019], list(streamed.table('YEAR').index))
+
+    # byte ranges should cover every row exactly once, on any number of workers
+    for parts in [1, 3, 50]:
+        ranges = load_data.byte_ranges(TEST_FILE, parts)
+        rows = pd.concat([load_data.load_range(TEST_FILE, start, end) for (start, end) in ranges])
+        assert_equals(list(load_data.load(TEST_FILE)['CASEID']), list(rows['CASEID']))
+    parallel = aggregate.aggregate_parallel([TEST_FILE], workers=2)
+    for dim in ['AGE', 'STATEFIP', 'EDUC', 'YEAR']:
+        assert_equals(aggregates.table(dim).values.tolist(), parallel.table(dim).values.tolist())
+
+    percent = metrics.rates(aggregates.table('AGE'))
+    assert_equals(list(percent['DEPRESS'] / percent['TOTAL']), list(percent['DEPRESS_PERCENT']))
+
+
+def test_codebook():
+    '''
+    the compiled codebook should have the tables the metadata pdfs had
+    '''
+    age = codebook.table('AGE')
+    assert_equals(['Value', 'Label', 'Frequency', '%'], list(age.columns))
+    assert_equals(['0–11 years', '12–14 years', '15–17 years', '18–20 years', '21–24 years', '25–29 years', '30–34 years', '35–39 years', '40–44 years', '45–49 years', '50–54 years', '55–59 years', '60–64 years', '65 years and older', 'Missing/unknown/not collected/invalid', 'Total'],
+                  list(age['Label']))
+    assert_equals('Full-time', codebook.labels('EMPLOY')[1])
+    # both pages of the state table
+    assert_equals(46, len(codebook.table('STATEFIP', total=False)))
+    assert_equals('Wyoming', codebook.labels('STATEFIP')[56])
+    # DataPrep looks the single page pdfs up without starting tabula
+    assert_equals(list(codebook.table('EDUC')['Label']), list(DataPrep(None).scrape('education.pdf')['Label']))
+    # and never starts it for a pdf it doesn't know
+    try:
+        DataPrep(None).scrape('Age Doc.pdf')
+        assert_equals('an unknown pdf', 'a table')
+    except ValueError:
+        pass
+
+
+def test_decode():
+    '''
+    decoding should give the same labels a left merge with the codebook table gives
+    '''
+    df = DataPrep(load_data.load(TEST_FILE)).clean_df()
+    features = df[machine_learning.FEATURE_COLUMNS]
+    decoded = machine_learning.merge_features(machine_learning.scrape_tables(), features)
+    assert_equals(['REGION', 'MARSTAT', 'RACE', 'EDUC', 'EMPLOY', 'AGE'], list(decoded.columns))
+    for col in machine_learning.FEATURE_COLUMNS:
+        table = codebook.table(col)
+        expected = features.merge(table, left_on=col, right_on='Value', how='left')['Label']
+        assert_equals(list(expected), list(decoded[col]))
+
+    # unknown codes become missing, like the merge left them
+    assert_equals(['Male', None], [None if pd.isna(label) else label for label in codebook.decode([1, 7], codebook.labels('GENDER'))])
+
+    # without decoding, the codes are only made categorical
+    codes = machine_learning.merge_features(None, features, decode=False)
+    assert_equals(list(features['AGE']), list(codes['AGE']))
+    assert_equals('category', str(codes['AGE'].dtype))
+
+
+def test_feature_encoder():
+    '''
+    the sparse one-hot matrix should match get_dummies on the same codes
+    '''
+    df = DataPrep(load_data.load(TEST_FILE)).clean_df()
+    columns = machine_learning.FEATURE_COLUMNS + machine_learning.EXTRA_FEATURE_COLUMNS
+    encoder = FeatureEncoder(columns)
+    matrix = encoder.transform(df)
+    assert_equals((len(df), len(encoder.feature_names())), matrix.shape)
+    # one nonzero per feature for every row
+    assert_equals([len(columns)] * len(df), list(matrix.getnnz(axis=1)))
+
+    dense = pd.DataFrame(matrix.toarray(), columns=encoder.feature_names())
+    dummies = pd.get_dummies(df[columns].astype(str), prefix_sep='_')
+    for name in dummies.columns:
+        assert_equals(list(dummies[name].astype(float)), list(dense[name]))
+
+
+def test_scrape_cache():
+    '''
+    a pdf should only be scraped once, and again after it changes
+    '''
+    calls = []
+
+    def scrape(pdf, pages):
+        calls.append(pdf)
+        return pd.DataFrame({'Value': [1.0], 'Label': ['scraped']})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf = os.path.join(tmp, 'fake.pdf')
+        with open(pdf, 'w') as f:
+            f.write('one')
+        cache = ScrapeCache(os.path.join(tmp, 'cache'))
+        cache.get(pdf, '1', scrape)
+        table = cache.get(pdf, '1', scrape)
+        assert_equals(['scraped'], list(table['Label']))
+        assert_equals([1, 1, 0], [cache.misses, cache.hits, cache.disk_hits])
+
+        # a new process only has the disk cache
+        cache.clear()
+        cache.get(pdf, '1', scrape)
+        assert_equals([1, 1, 1], [cache.misses, cache.hits, cache.disk_hits])
+
+        with open(pdf, 'w') as f:
+            f.write('two')
+        cache.get(pdf, '1', scrape)
+        assert_equals(2, len(calls))
+
+        # eviction keeps the directory under its size limit
+        small = ScrapeCache(os.path.join(tmp, 'small'), max_bytes=1)
+        small.get(pdf, '1', scrape)
+        assert_equals([], os.listdir(os.path.join(tmp, 'small')))
+
+
+def test_render():
+    '''
+    figures should come out the same on a process pool as in one process
+    '''
+    data = pd.DataFrame({'UrbanPop': [1, 2, 3], 'TOTAL': [4, 5, 7], 'ANXIETY': [1, 1, 2]})
+    rates = metrics.rates(data, ['ANXIETY'])
+    assert_equals(11, len(report.plot_urban(rates)))
+    with tempfile.TemporaryDirectory() as tmp:
+        for workers in [1, 2]:
+            jobs = report.plot_urban(rates)
+            files = [os.path.join(tmp, str(workers) + job.filename) for job in jobs[:3]]
+            for (job, filename) in zip(jobs, files):
+                job.filename = filename
+            manifest = os.path.join(tmp, str(workers) + '.json')
+            assert_equals(files, render.render(jobs[:3], workers, manifest=manifest))
+            assert_equals(True, all(os.path.getsize(f) > 0 for f in files))
+    # percents are computed on a copy
+    assert_equals(['UrbanPop', 'TOTAL', 'ANXIETY'], list(data.columns))
+
+
+def test_incremental_render():
+    '''
+    only figures whose data or parameters changed should be rendered again
+    '''
+    data = pd.DataFrame({'UrbanPop': [1, 2, 3], 'TOTAL': [4, 5, 7], 'ANXIETY': [1, 1, 2]})
+    other = pd.DataFrame({'Crime Rate': [1, 2, 3], 'TOTAL': [4, 5, 7], 'ANXIETY': [1, 1, 2]})
+    with tempfile.TemporaryDirectory() as tmp:
+        manifest = os.path.join(tmp, 'figures.json')
+
+        def jobs(urb, crime):
+            jobs = report.plot_urban(urb)[:2] + report.plot_crime(crime)[:1]
+            for job in jobs:
+                job.filename = os.path.join(tmp, job.filename)
+            return jobs
+
+        assert_equals(3, len(render.render(jobs(data, other), 1, manifest=manifest)))
+        assert_equals([], render.render(jobs(data.copy(), other), 1, manifest=manifest))
+
+        # a changed crime table only redraws the crime figure
+        changed = other.assign(ANXIETY=[2, 1, 2])
+        assert_equals(1, len(render.stale(jobs(data, changed), manifest)))
+        assert_equals([os.path.join(tmp, 'crime_Anxiety_number.png')],
+                      render.render(jobs(data, changed), 1, manifest=manifest))
+
+        # a deleted figure is stale, and force redraws everything
+        os.remove(os.path.join(tmp, 'urban_vs_total.png'))
+        assert_equals(1, len(render.stale(jobs(data, changed), manifest)))
+        assert_equals(3, len(render.render(jobs(data, changed), 1, force=True, manifest=manifest)))
+
+
+def test_geometry():
+    '''
+    state shapes should be keyed by FIPS code, simplified and cached
+    '''
+    with tempfile.TemporaryDirectory() as tmp:
+        full = geometry.state_shapes(tolerance=0, cache_dir=tmp)
+        simple = geometry.state_shapes(cache_dir=tmp)
+        assert_equals(['STATEFIP', 'NAME', 'geometry'], list(simple.columns))
+        assert_equals(50, len(simple))
+        assert_equals(False, simple['STATEFIP'].isin([2, 15]).any())
+        assert_equals('Washington', simple.set_index('STATEFIP').loc[53, 'NAME'])
+        assert_equals(True, shapely.get_num_coordinates(simple.geometry).sum()
+                      < shapely.get_num_coordinates(full.geometry).sum())
+        assert_equals(2, len(os.listdir(tmp)))
+
+        # a new process reads the parquet file
+        geometry._shapes.clear()
+        cached = geometry.state_shapes(cache_dir=tmp)
+        assert_equals(True, cached.geom_equals(simple).all())
+        assert_equals(list(simple['NAME']), list(cached['NAME']))
+
+
+def test_states():
+    '''
+    names and abbreviations should all be keyed by FIPS code
+    '''
+    income = pd.DataFrame({'State': [' Alabama', 'tx\xa0', 'Nowhere', 'ALABAMA', 'District of Columbia'],
+                           'Avg Income 2019': [1, 2, 3, 4, 5]})
+    keyed = states.to_fips(income, 'State', 'income')
+    assert_equals([1, 48, 11], list(keyed.index))
+    assert_equals([1, 2, 5], list(keyed['Avg Income 2019']))
+
+    data = pd.DataFrame({'STATEFIP': [48, 1, 6], 'TOTAL': [10, 20, 30]})
+    joined = states.join(data, keyed, 'income')
+    assert_equals([48, 1, 6], list(joined['STATEFIP']))
+    assert_equals([2.0, 1.0], list(joined['Avg Income 2019'][:2]))
+    assert_equals(True, pd.isna(joined['Avg Income 2019'][2]))
+    assert_equals('CA', states.states().loc[6, 'ABBREV'])
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class SlowHandler(QuietHandler):
+    def do_GET(self):
+        time.sleep(0.5)
+        super().do_GET()
+
+
+def fixture_server(handler=QuietHandler):
+    '''
+    serves the saved pages in fixtures/ on a local port, in place of the live sites
+    '''
+    handler = functools.partial(handler, directory='fixtures')
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_providers():
+    '''
+    pages should be fetched once, kept as snapshots, and work offline
+    '''
+    server = fixture_server()
+    base = 'http://127.0.0.1:' + str(server.server_address[1]) + '/'
+    income = providers.Provider('income', base + 'income.html', scrape_income.parse)
+    weather = providers.Provider('weather', base + 'weather.html', scrape_weather.parse, ttl=0)
+    with tempfile.TemporaryDirectory() as tmp:
+        store = providers.SnapshotStore(tmp, offline=False, retries=1)
+        table = store.table(income)
+        assert_equals(51, len(table))
+        assert_equals('Alabama', table['State'][0])
+        store.table(income)
+        assert_equals(1, store.fetches)
+
+        # an expired snapshot is fetched again
+        assert_equals(51, len(store.table(weather)))
+        store.table(weather)
+        assert_equals(3, store.fetches)
+        assert_equals(2, len(store.snapshots(weather)))
+
+        # the live site isn't needed offline, or once it's gone
+        server.shutdown()
+        server.server_close()
+        offline = providers.SnapshotStore(tmp, offline=True)
+        assert_equals(list(table['Avg Income 2019']), list(offline.table(income)['Avg Income 2019']))
+        assert_equals(51, len(store.table(weather)))
+        try:
+            providers.SnapshotStore(os.path.join(tmp, 'empty'), offline=True).table(income)
+            assert_equals('no snapshot', 'a table')
+        except FileNotFoundError:
+            pass
+
+
+def test_refresh():
+    '''
+    out of date sources should all be fetched at the same time
+    '''
+    server = fixture_server(SlowHandler)
+    base = 'http://127.0.0.1:' + str(server.server_address[1]) + '/'
+    sources = [providers.Provider('income', base + 'income.html', scrape_income.parse),
+               providers.Provider('weather', base + 'weather.html', scrape_weather.parse),
+               providers.Provider('missing', base + 'missing.html', scrape_weather.parse)]
+    with tempfile.TemporaryDirectory() as tmp:
+        store = providers.SnapshotStore(tmp, offline=False, retries=1)
+        start = time.time()
+        try:
+            store.refresh(sources)
+            assert_equals('an error', 'no error')
+        except requests.HTTPError:
+            pass
+        # the two pages that exist were still saved, so they aren't fetched again
+        tables = store.refresh(sources[:2])
+        # each page takes half a second to serve
+        assert_equals(True, time.time() - start < 1.4)
+        assert_equals(2, store.fetches)
+        assert_equals(51, len(tables['weather']))
+        assert_equals(list(tables['income']['State']), list(store.table(sources[0])['State']))
+        assert_equals(2, store.fetches)
+    server.shutdown()
+    server.server_close()
+
+
+def test_html_table():
+    '''
+    only the matching table should be read, with its text cleaned up
+    '''
+    html = ('<table><tr><td><table><tr><th>Rank</th><th>Income</th></tr>'
+            '<tr><td>1</td><td> $56,200\n</td></tr><tr><td colspan="2">note</td></tr></table>'
+            '<table><tr><td>Other</td></tr></table></td></tr></table>')
+    table = html_table.read_table(html, 'Income')
+    assert_equals(['Rank', 'Income'], list(table.columns))
+    assert_equals(['$56,200'], list(table['Income']))
+    assert_equals([56200, -1.5], list(html_table.numbers(pd.Series(['$56,200', '-1.5°F']))))
+
+    with open('fixtures/weather.html', 'rb') as f:
+        weather = scrape_weather.parse(f.read())
+    assert_equals(['Idaho', 71.9], [weather['State Name'][0], weather['Avg Temp'][0]])
+
+    # a note that mentions 2019 before the income table isn't the income table
+    with open('fixtures/income.html', 'rb') as f:
+        income = scrape_income.parse(f.read())
+    with open('fixtures/income_note.html', 'rb') as f:
+        assert_equals(True, income.equals(scrape_income.parse(f.read())))
+    assert_equals(['Note'], list(html_table.read_table(html.replace('Other', 'Note'), 'Note').columns))
+
+
+def test_benchmark():
+    '''
+    synthetic data should stay in the codebook's domains, and every stage should be timed
+    '''
+    df = benchmark.synthetic(5000)
+    assert_equals(load_data.header(TEST_FILE), list(df.columns))
+    for col in ['AGE', 'STATEFIP', 'DEPRESSFLG']:
+        assert_equals(True, df[col].isin(codebook.labels(col)).all())
+
+    stages = benchmark.run(2000)
+    assert_equals(['load', 'clean_df', 'aggregates'], list(stages)[:3])
+    assert_equals(True, all(stage['seconds'] >= 0 for stage in stages.values()))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = benchmark.save(stages, 2000, path=os.path.join(tmp, 'run.json'))
+        table = benchmark.compare(path, path)
+        assert_equals([1.0] * len(stages), list(table['time ratio'].fillna(1.0)))
+
+
+def test_instrument():
+    '''
+    stages should be timed, nested, counted and optionally profiled
+    '''
+    instrument.reset()
+    data = DataPrep(load_data.load(TEST_FILE))
+    with instrument.stage('report') as record:
+        df = data.clean_df()
+        data.age_data(df)
+        record['rows_out'] = len(df)
+    stages = instrument.records()
+    names = [stage['stage'] for stage in stages]
+    assert_equals(['report', 'data_prep.DataPrep.clean_df', 'data_prep.DataPrep.age_data'], names[:3])
+    assert_equals([0, 1, 1], [stage['depth'] for stage in stages[:3]])
+    assert_equals([None, 19, 19], [stages[1]['rows_in'], stages[1]['rows_out'], stages[2]['rows_in']])
+    assert_equals(True, all(stage['wall_s'] >= 0 and stage['cpu_s'] >= 0 for stage in stages))
+    assert_equals(True, '  data_prep.DataPrep.clean_df' in instrument.summary())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        profile_dir = instrument.PROFILE_DIR
+        instrument.PROFILE_DIR = tmp
+        instrument.profile(['groupby_state'])
+        try:
+            data.groupby_state(df)
+        finally:
+            instrument.profile([])
+            instrument.PROFILE_DIR = profile_dir
+        assert_equals(['data_prep.DataPrep.groupby_state.prof'], os.listdir(tmp))
+
+        path = instrument.report(os.path.join(tmp, 'run.json'), data=[TEST_FILE])
+        with open(path) as f:
+            saved = json.load(f)
+        assert_equals(len(instrument.records()), len(saved['stages']))
+        assert_equals([TEST_FILE], saved['data'])
+    instrument.reset()
+
+    # without a way to read the process size, memory is left out instead of failing
+    rss = instrument._rss
+    instrument._rss = lambda: None
+    try:
+        data.groupby_state(df)
+        (_, stats) = benchmark.measure(data.age_data, df)
+    finally:
+        instrument._rss = rss
+    assert_equals([None, None], [instrument.records()[0]['rss_mb'], instrument.records()[0]['mem_delta_mb']])
+    assert_equals(None, stats['peak_rss_mb'])
+    assert_equals(True, 'data_prep.DataPrep.groupby_state' in instrument.summary())
+    instrument.reset()
+
+
+def test_cli():
+    '''
+    the entry point should start quickly, without importing the heavy libraries
+    '''
+    loaded = subprocess.run([sys.executable, '-c', 'import sys, cli; print([m for m in cli.HEAVY_MODULES '
+                             'if m in sys.modules])'], capture_output=True, text=True, check=True)
+    assert_equals('[]', loaded.stdout.strip())
+    for args in [['--help'], ['report', '--help'], ['train', '--help']]:
+        assert_equals(True, cli.startup_time(args) < cli.IMPORT_BUDGET)
+
+    args = cli.parser().parse_args(['report', '--dry-run', '--data', 'a.csv', 'b.csv'])
+    assert_equals((cli.report, ['a.csv', 'b.csv'], True), (args.run, args.data, args.dry_run))
+
+
+def test_cross_validate():
+    '''
+    codes should be renumbered as categories, and every row held out once
+    '''
+    df = pd.DataFrame({'AGE': [-9, 1, 14, 99], 'REGION': [0, 1, 4, 9]})
+    codes = FeatureEncoder(['AGE', 'REGION']).codes(df)
+    assert_equals([0.0, 1.0, 14.0], [float(code) for code in codes[:3, 0]])
+    assert_equals([0.0, 1.0, 4.0], [float(code) for code in codes[:3, 1]])
+    assert_equals([True, True], list(np.isnan(codes[3])))
+
+    df = benchmark.synthetic(600)
+    labels = df['MH1'].to_numpy()
+    for model in machine_learning.MODELS:
+        features = machine_learning.model_features(df, machine_learning.FEATURE_COLUMNS, model)
+        scores = machine_learning.cross_validate(features, labels, model, folds=3, n_jobs=2, seed=1)
+        assert_equals([0, 1, 2], list(scores.index))
+        assert_equals(600, scores['test_rows'].sum())
+        assert_equals(True, scores['accuracy'].between(0, 1).all())
+        assert_equals(True, (scores['fit_rows_per_s'] > 0).all())
+
+
+def test_search():
+    '''
+    successive halving should keep a third of the candidates each round on
+    three times the rows, with every prefix of the rows stratified
+    '''
+    labels = np.array([1] * 300 + [2] * 600 + [3] * 100)
+    order = machine_learning.stratified_order(labels, seed=1)
+    assert_equals(sorted(order), list(range(1000)))
+    assert_equals([30, 60, 10], [int((labels[order[:100]] == label).sum()) for label in [1, 2, 3]])
+
+    df = benchmark.synthetic(3000)
+    columns = machine_learning.FEATURE_COLUMNS
+    matrices = {kind: machine_learning.model_features(df, columns, kind) for kind in machine_learning.MODELS}
+    configs = machine_learning.candidates({'tree': {'max_depth': [2, 4, 8, None], 'min_samples_leaf': [1, 50]},
+                                           'boosting': {'max_depth': [3]}})
+    assert_equals(9, len(configs))
+    best, results = machine_learning.successive_halving(matrices, df['MH1'].to_numpy(), np.arange(3000),
+                                                        configs, min_rows=200, n_jobs=2, seed=1)
+    rounds = results.groupby('round').agg(candidates=('candidate', 'size'), rows=('rows', 'max'))
+    assert_equals([9, 3, 1], list(rounds['candidates']))
+    assert_equals([200, 600, 1800], list(rounds['rows']))
+    assert_equals(True, best in configs)
+    assert_equals(True, results['best_accuracy'].is_monotonic_increasing)
+
+
+def test_score():
+    '''
+    a saved model should score a csv in chunks like the model in memory
+    '''
+    df = benchmark.synthetic(500)
+    columns = machine_learning.FEATURE_COLUMNS
+    with tempfile.TemporaryDirectory() as tmp:
+        data_file = os.path.join(tmp, 'intake.csv')
+        df.to_csv(data_file, index=False)
+        for kind in machine_learning.MODELS:
+            encoder = FeatureEncoder(columns)
+            features = machine_learning.model_features(df, columns, kind, encoder)
+            model, _ = machine_learning.train_the_model(features, df['MH1'].to_numpy(), kind)
+            model_file = os.path.join(tmp, 'models', kind + '.joblib')
+            machine_learning.save_model(model_file, model, encoder, kind)
+
+            output = os.path.join(tmp, 'predictions.csv')
+            stats = machine_learning.score(data_file, output, model_file, chunk_size=128)
+            assert_equals(500, stats['rows'])
+            scored = pd.read_csv(output)
+            assert_equals(list(df['CASEID']), list(scored['CASEID']))
+            assert_equals(list(model.predict(features)), list(scored['PREDICTED_MH1']))
+            probabilities = scored[['P_' + str(c) for c in model.classes_]].sum(axis=1)
+            assert_equals(True, bool(np.allclose(probabilities, 1, atol=0.01)))
+
+
+def test_comorbidity():
+    '''
+    the packed flags should unpack to the flag columns, and the co-occurrence
+    and combination counts should match pairwise column scans
+    '''
+    df = benchmark.synthetic(5000)
+    flags = load_data.FLAGS
+    bits = load_data.pack_flags(df)
+    assert_equals('uint16', str(bits.dtype))
+    assert_equals(True, (load_data.unpack_flags(bits) == (df[flags] == 1).astype('int8')).all().all())
+
+    has = (df[flags] == 1).astype(int)
+    expected = has.T @ has
+    assert_equals(expected.values.tolist(), comorbidity.cooccurrence(bits).values.tolist())
+    by_state = comorbidity.cooccurrence(bits, df['STATEFIP'])
+    alabama = has[df['STATEFIP'] == 1]
+    assert_equals((alabama.T @ alabama).values.tolist(), by_state.loc[1].values.tolist())
+
+    combinations = comorbidity.combinations(bits)
+    assert_equals(5000, combinations.sum())
+    assert_equals(True, combinations.is_monotonic_decreasing)
+    assert_equals(int((has.sum(axis=1) == 0).sum()), combinations['NONE'])
+    both = has['ANXIETYFLG'] & has['DEPRESSFLG'] & (has.sum(axis=1) == 2)
+    assert_equals(int(both.sum()), combinations.get('ANXIETYFLG+DEPRESSFLG', 0))
+    by_age = comorbidity.combinations(bits, df['AGE'])
+    assert_equals(df.groupby('AGE').size().tolist(), by_age.groupby(level='AGE').sum().tolist())
+
+    # the cleaned data cache carries the bitmask
+    with tempfile.TemporaryDirectory() as cache_dir:
+        bits, ages = comorbidity.load_flags(TEST_FILE, 'AGE', cache_dir)
+        clean = DataPrep(load_data.load(TEST_FILE)).clean_df()
+        assert_equals(list(load_data.pack_flags(clean)), list(bits))
+        assert_equals(list(clean['AGE']), list(ages))
+
+
+def test_metrics():
+    '''
+    every disorder's rate, interval and per 100k rate should come out of
+    one call, without changing the table it was given
+    '''
+    table = pd.DataFrame({'ANXIETY': [0, 5, 3], 'DEPRESS': [10, 5, 6], 'SCHIZO': [1, 1, 1],
+                          'TRAUMA': [2, 2, 2], 'ADHD': [0, 0, 0], 'TOTAL': [10, 10, 19],
+                          'Population': [1000000, 50000, 200000]})
+    before = table.copy()
+    rates = metrics.rates(table, population='Population')
+    assert_equals(True, table.equals(before))
+    assert_equals([0.0, 0.5], list(rates['ANXIETY_PERCENT'][:2]))
+    assert_equals([0.0, 0.2366, 0.0552], [round(low, 4) for low in rates['ANXIETY_LOW']])
+    assert_equals([0.2775, 0.7634], [round(high, 4) for high in rates['ANXIETY_HIGH'][:2]])
+    assert_equals([1.0, 10.0], list(rates['DEPRESS_PER_100K'][:2]))
+
+    exact = metrics.rates(table, method='clopper-pearson')
+    assert_equals([0.6915, 0.1871, 0.1258], [round(low, 4) for low in exact['DEPRESS_LOW']])
+    assert_equals(1.0, exact['DEPRESS_HIGH'][0])
+    assert_equals([0.3085, 0.8129], [round(high, 4) for high in exact['ANXIETY_HIGH'][:2]])
+    assert_equals(True, (exact['DEPRESS_HIGH'] >= exact['DEPRESS_PERCENT']).all())
+    try:
+        metrics.rates(table, method='wilsen')
+        assert_equals('unknown method', 'an interval')
+    except ValueError:
+        pass
+
+    # works on the aggregate tables, with their disorders in a different order
+    aggregates = DisorderAggregates.from_frame(DataPrep(load_data.load(TEST_FILE)).clean_df())
+    counts = aggregates.table('AGE')
+    rates = metrics.rates(counts)
+    for disorder in metrics.DISORDERS:
+        assert_equals(list(counts[disorder] / counts['TOTAL']), list(rates[disorder + '_PERCENT']))
+
+
+def test_cube():
+    '''
+    marginals and cross-tabs from the cube should match groupbys on the rows
+    '''
+    df = DataPrep(load_data.load(TEST_FILE)).clean_df()
+    cube = CountCube.from_frame(df)
+
+    age = cube.marginal('AGE', ['ANXIETYFLG', 'DEPRESSFLG'])
+    expected = df.groupby('AGE').aggregate({'CASEID': 'count', 'ANXIETYFLG': 'sum', 'DEPRESSFLG': 'sum'})
+    assert_equals(expected.values.tolist(), age.values.tolist())
+
+    crosstab = cube.crosstab('REGION', 'GENDER', 'DEPRESSFLG')
+    expected = df.pivot_table(index='REGION', columns='GENDER', values='DEPRESSFLG', aggfunc='sum')
+    assert_equals(expected.values.tolist(), crosstab.values.tolist())
+
+    where = cube.query(['AGE'], ['SCHIZOFLG'], where={'GENDER': 2})
+    expected = df[df['GENDER'] == 2].groupby('AGE')['SCHIZOFLG'].sum()
+    assert_equals(list(expected), list(where['SCHIZOFLG']))
+
+    # STATEFIP fixes REGION, so the cells leave it out and map it back for higher order queries
+    assert_equals(False, 'REGION' in cube.cells().columns)
+    by = cube.query(['REGION', 'AGE', 'GENDER'], ['TRAUSTREFLG'])
+    expected = df.groupby(['REGION', 'AGE', 'GENDER'])['TRAUSTREFLG'].sum()
+    assert_equals(list(expected), list(by['TRAUSTREFLG']))
+
+    # merging partial cubes gives the same cells as building it in one go
+    merged = CountCube.merge([CountCube.from_frame(df.iloc[:7]), CountCube.from_frame(df.iloc[7:])])
+    assert_equals(True, merged.cells().equals(cube.cells()))
+
+    # a rate is only defined where there are cases
+    counts = cube.crosstab('AGE', 'GENDER')
+    rates = cube.crosstab('AGE', 'GENDER', 'DEPRESSFLG', rate=True)
+    assert_equals(True, bool((counts == 0).values.any()))
+    assert_equals((counts == 0).values.tolist(), rates.isna().values.tolist())
+
+    # the saved cube, and one built from chunks, have the same cells
+    with tempfile.TemporaryDirectory() as cache_dir:
+        built = load_cube(TEST_FILE, cache_dir)
+        cube_file = os.path.splitext(data_cache.cached(TEST_FILE, cache_dir))[0] + '.cube.parquet'
+        saved = os.stat(cube_file).st_mtime_ns
+        loaded = load_cube(TEST_FILE, cache_dir)
+        assert_equals(saved, os.stat(cube_file).st_mtime_ns)
+        assert_equals(True, loaded.cells().equals(built.cells()))
+        assert_equals(True, loaded.cells().equals(cube.cells()))
+        assert_equals(True, loaded.crosstab('AGE', 'REGION').equals(cube.crosstab('AGE', 'REGION')))
+    chunks = (DataPrep(chunk).clean_df() for chunk in load_data.load_chunks(TEST_FILE, chunk_size=5))
+    assert_equals(True, CountCube.from_chunks(chunks).cells().equals(cube.cells()))
+
+
+def test_our_code():
+    '''
+    the original checks of scraping, merging and grouping the truncated dataset
+    '''
     # load truncated dataset
     df = pd.read_csv('Testing File Mental Health.csv').loc[0:10, :]
 
@@ -31,5 +730,32 @@ def main():
     assert_equals(groupby_expected, list(groupby))
 
 
+def main():
+    test_our_code()
+    test_load_data()
+    test_data_cache()
+    test_aggregates()
+    test_codebook()
+    test_decode()
+    test_feature_encoder()
+    test_scrape_cache()
+    test_render()
+    test_incremental_render()
+    test_geometry()
+    test_states()
+    test_providers()
+    test_refresh()
+    test_html_table()
+    test_benchmark()
+    test_instrument()
+    test_cli()
+    test_cross_validate()
+    test_search()
+    test_score()
+    test_comorbidity()
+    test_metrics()
+    test_cube()
+
+
 if __name__ == '__main__':
     main()
\ No newline at end of file